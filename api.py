@@ -1,21 +1,60 @@
+import asyncio
+import functools
+import heapq
+import inspect
 import json
 import math
+import secrets
 import sqlite3
+import time
 from datetime import datetime, timedelta
 from email.message import EmailMessage
 from email.utils import formatdate
-from smtplib import SMTP
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel, BaseSettings, Field
 
+import export
+import rollup
+from compression import CompressionMiddleware
+from database import (DT_FMT, count_usage, get_last_update,
+                      get_reports_version, iter_usage, load_users, strptime)
+from mailer import Mailer
+from migrate import is_upgraded
+from snapshot import Snapshot, load as load_snapshot
+
 
-DT_FMT = "%Y%m%d%H%M"
 # Runtime labels
 RUNTIMES = ["&le; 1 min", "1 - 10 min", "10 min - 1 h", "1 - 3 h", "3 - 6 h",
             "6 - 12 h", "12 h - 1 d", "1 - 2 d", "2 - 3 d", "3 - 7 d",
             "&gt; 7 d"]
+# Maximum number of usage rows scanned by requests not served from a snapshot
+# (35040 rows: one year of 15-minute rows), 0 for no limit
+SCAN_BUDGETS = {
+    "activity": 35040,
+    "footprint_teams": 35040,
+    "cpu": 140160,
+    "memory": 140160,
+    "runtime": 140160,
+    "statuses": 70080,
+    "user_footprint": 70080,
+    "team_activity": 35040
+}
+# Maximum number of encoded reports kept in memory
+REPORTS_CACHE_SIZE = 1024
+# Data version, the time of the latest update
+VERSION_FMT = "%Y%m%d%H%M%S"
+# Breakdown metrics and their column in the daily usage
+METRICS = {
+    "co2e": "co2e",
+    "cost": "cost",
+    "cputime": "cputime",
+    "cores": "core_minutes"
+}
 
 
 class Settings(BaseSettings):
@@ -24,9 +63,18 @@ class Settings(BaseSettings):
     admin_password: str
     smtp_host: str
     smtp_port: int
+    smtp_starttls: bool = True
     admin_slack: str = None
     days: int = Field(14, gt=0)
     notify_on_signup: bool = False
+    snapshot: str = None
+    api_token: str = None
+    warm_up_interval: int = Field(60, ge=0)
+    email_queue: str = None
+    email_dedup_window: int = Field(3600, ge=0)
+    scan_budgets: dict[str, int] = {}
+    scan_timeout: float = Field(30, gt=0)
+    compress_min_size: int = Field(1024, ge=0)
 
     class Config:
         @classmethod
@@ -104,12 +152,23 @@ tags = [
     {
         "name": "User report",
         "description": "Get your carbon footprint for a given month"
+    },
+    {
+        "name": "Breakdown",
+        "description": "Get the footprint per user, team, day or week "
+                       "(requires an API token)"
+    },
+    {
+        "name": "Export",
+        "description": "Download usage data as CSV or JSON Lines "
+                       "(requires an API token)"
     }
 ]
 app = FastAPI(
     title="EMBL-EBI HPC CO2",
     description="Simple carbon footprint tracker for EMBL-EBI",
     openapi_tags=tags,
+    default_response_class=ORJSONResponse,
     docs_url="/docs/",
     redoc_url=None
 )
@@ -119,74 +178,270 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware,
+                   minimum_size=settings.compress_min_size)
+# Responses of default views, precomputed for the latest data version
+cache = {
+    "version": None,
+    "responses": {},
+    # Encoded reports of closed months, per user
+    "reports": {}
+}
+bearer = HTTPBearer(auto_error=False)
+warm_up_views = []
+warm_up_task = None
+# Cache update in progress
+cache_update = None
+# Emails are sent in the background, from a persistent queue
+mailer = Mailer(settings.email_queue or f"{settings.database}.mail",
+                host=settings.smtp_host,
+                port=settings.smtp_port,
+                username=settings.admin_email[0].split("@")[0],
+                password=settings.admin_password,
+                starttls=settings.smtp_starttls,
+                dedup_window=settings.email_dedup_window)
+mailer_task = None
+
+
+def cached(func):
+    params = inspect.signature(func).parameters
+    defaults = {name: param.default for name, param in params.items()}
+
+    # Default view, in each format supported by the view
+    variants = [{}]
+    for name in ("columnar", "delta"):
+        if name in params:
+            variants.append({name: True})
+
+    @functools.wraps(func)
+    async def wrapper(**kwargs):
+        for variant in variants:
+            if kwargs == {**defaults, **variant}:
+                key = (func.__name__, tuple(variant.items()))
+                if key not in cache["responses"]:
+                    # Warm-up disabled, or not done yet
+                    break
+
+                con = sqlite3.connect(settings.database)
+                version = get_cache_version(con)
+                con.close()
+                if version != cache["version"]:
+                    # Data updated since the view was computed: wait for
+                    # the cache update rather than scanning for each request
+                    try:
+                        await refresh_cache()
+                    except Exception as exc:
+                        print(exc)
+                        break
+
+                return Response(content=cache["responses"][key],
+                                media_type="application/json")
+
+        return await func(**kwargs)
+
+    for variant in variants:
+        warm_up_views.append((func, variant))
+
+    return wrapper
+
+
+@app.on_event("startup")
+async def check_schema():
+    con = sqlite3.connect(settings.database)
+    upgraded = is_upgraded(con)
+    con.close()
+    if not upgraded:
+        raise RuntimeError(f"{settings.database}: outdated usage table, "
+                           f"run: python migrate.py {settings.database}")
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    global warm_up_task
+    if settings.warm_up_interval > 0:
+        warm_up_task = asyncio.create_task(warm_up())
+
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+
+
+@app.on_event("startup")
+async def start_mailer():
+    global mailer_task
+    mailer_task = asyncio.create_task(mailer.run())
+
+
+@app.on_event("shutdown")
+async def stop_mailer():
+    if mailer_task is not None:
+        mailer_task.cancel()
+
+
+async def warm_up():
+    while True:
+        try:
+            await refresh_cache()
+        except Exception as exc:
+            print(exc)
+
+        await asyncio.sleep(settings.warm_up_interval)
+
+
+async def refresh_cache():
+    # Update the cache, or wait for the update in progress
+    global cache_update
+    if cache_update is None or cache_update.done():
+        cache_update = asyncio.ensure_future(run_in_threadpool(update_cache))
+
+    # Requests cancelled while waiting do not cancel the update
+    await asyncio.shield(cache_update)
+
+
+def update_cache():
+    con = sqlite3.connect(settings.database)
+    version = get_cache_version(con)
+    con.close()
+
+    if version != cache["version"]:
+        # Previous responses are not served while views are computed
+        responses = {}
+        for func, variant in warm_up_views:
+            key = (func.__name__, tuple(variant.items()))
+            # Encoded bodies: responses are not reused across requests
+            responses[key] = asyncio.run(func(**variant)).body
+
+        cache["responses"] = responses
+        cache["version"] = version
 
 
 @app.get("/", tags=["Root"])
 async def root():
     con = sqlite3.connect(settings.database)
     dt = get_last_update(con)
+    reports_version = get_version(con, reports=True)
     con.close()
-    return {
+    return ORJSONResponse({
         "meta": {
             "email": settings.admin_email[0],
             "slack": settings.admin_slack,
-            "updated": dt.strftime("%A, %d %b %Y, %H:%M")
+            "updated": dt.strftime("%A, %d %b %Y, %H:%M"),
+            "version": dt.strftime(VERSION_FMT),
+            "reportsVersion": reports_version
         }
-    }
+    })
 
 
 @app.get("/activity/", tags=["Overall activity"])
+@cached
 async def get_overall_activity(start: str | None = None,
                                stop: str | None = None,
-                               days: int = settings.days):
+                               days: int = settings.days,
+                               columnar: bool = False,
+                               delta: bool = False):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
 
-    activity = []
+    timestamps = []
+    cores = []
+    memory = []
+    submitted = []
+    completed = []
+    failed = []
     sliding_window = []
     core_events = {}
     mem_events = {}
     cpu_time = co2e = cost = 0
 
-    for dt_str, ts, users_data, _ in iter_usage(con, start, stop):
-        user_cores = {}
-        user_memory = {}
-        submitted_jobs = 0
-        completed_jobs = 0
-        failed_jobs = 0
-        for user, values in users_data.items():
-            user_cores[user] = values["cores"]
-            user_memory[user] = values["memory"]
-            submitted_jobs += values["submitted"]
-            completed_jobs += values["done"]
-            failed_jobs += values["failed"]["total"]
+    snapshot = get_snapshot(con)
+    if snapshot is not None:
+        s = snapshot.slice(start, stop)
+        timestamps = snapshot["time"][s].tolist()
+        cores = snapshot["cores"][s].tolist()
+        memory = snapshot["memory"][s].tolist()
+        submitted = snapshot["submitted"][s].tolist()
+        completed = snapshot["completed"][s].tolist()
+        failed = snapshot["failed"][s].tolist()
+        co2e = snapshot["co2e"][s].sum().item()
+        cost = snapshot["cost"][s].sum().item()
+        cpu_time = snapshot["cputime"][s].sum().item()
+    else:
+        for ts, day, users_data, _ in scan_usage(con, "activity", start, stop,
+                                                 jobs=False):
+            user_cores = {}
+            user_memory = {}
+            submitted_jobs = 0
+            completed_jobs = 0
+            failed_jobs = 0
+            for user, values in users_data.items():
+                user_cores[user] = values["cores"]
+                user_memory[user] = values["memory"]
+                submitted_jobs += values["submitted"]
+                completed_jobs += values["done"]
+                failed_jobs += values["failed"]["total"]
+
+                co2e += values["co2e"]
+                cost += values["cost"]
+                cpu_time += values["cputime"]
+
+            timestamps.append(ts)
+            cores.append(sum(user_cores.values()))
+            memory.append(sum(user_memory.values()))
+            submitted.append(submitted_jobs)
+            completed.append(completed_jobs)
+            failed.append(failed_jobs)
+
+            # if len(sliding_window) == 8:  # 8 * 15min: window of 2h
+            #     sliding_window.pop(0)
+            #
+            # sliding_window.append((ts, user_cores, user_memory))
+            # find_events(sliding_window, core_events, mem_events,
+            #             min_growth=1.5)
 
-            co2e += values["co2e"]
-            cost += values["cost"]
-            cpu_time += values["cputime"]
+    con.close()
 
-        activity.append({
-            "timestamp": ts,
-            "cores": sum(user_cores.values()),
-            "memory": sum(user_memory.values()),
+    if delta:
+        activity = {
+            "timestamps": encode_series(timestamps),
+            "cores": encode_series(cores, 2),
+            "memory": encode_series(memory, 2),
             "jobs": {
-                "submitted": submitted_jobs,
-                "completed": completed_jobs,
-                "failed": failed_jobs
+                "submitted": encode_series(submitted),
+                "completed": encode_series(completed),
+                "failed": encode_series(failed)
             }
-        })
-
-        # if len(sliding_window) == 8:  # 8 * 15min: window of 2h
-        #     sliding_window.pop(0)
-        #
-        # sliding_window.append((ts, user_cores, user_memory))
-        # find_events(sliding_window, core_events, mem_events, min_growth=1.5)
-
-    con.close()
+        }
+    elif columnar:
+        activity = {
+            "timestamps": timestamps,
+            "cores": cores,
+            "memory": memory,
+            "jobs": {
+                "submitted": submitted,
+                "completed": completed,
+                "failed": failed
+            }
+        }
+    else:
+        activity = []
+        for i, ts in enumerate(timestamps):
+            activity.append({
+                "timestamp": ts,
+                "cores": cores[i],
+                "memory": memory[i],
+                "jobs": {
+                    "submitted": submitted[i],
+                    "completed": completed[i],
+                    "failed": failed[i]
+                }
+            })
 
-    return {
+    return ORJSONResponse({
         "data": {
             "activity": activity,
             "events": {
@@ -200,14 +455,17 @@ async def get_overall_activity(start: str | None = None,
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/footprint/", tags=["Monthly carbon footprint"])
+@cached
 async def get_monthly_footprint(months: int = 6):
     con = sqlite3.connect(settings.database)
+    version = get_version(con, reports=True)
     dt = get_last_update(con)
     stop = datetime(dt.year, dt.month, 1)
     month = stop.month - months
@@ -244,21 +502,24 @@ async def get_monthly_footprint(months: int = 6):
         else:
             dt = datetime(dt.year + 1, 1, 1)
 
-    return {
+    return ORJSONResponse({
         "data": data,
         "meta": {
             "months": months,
             "start": start.strftime("%B %Y"),
-            "stop": stop.strftime("%B %Y")
+            "stop": stop.strftime("%B %Y"),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/footprint/teams/", tags=["Teams carbon footprint"])
+@cached
 async def get_daily_team_footprint(start: str | None = None,
                                    stop: str | None = None,
                                    days: int = settings.days):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2day(start)
     stop = floor2hour(stop)
@@ -275,12 +536,20 @@ async def get_daily_team_footprint(start: str | None = None,
                 "cputime": 0
             }
 
+    if not rollup.exists(con):
+        rows = scan_usage(con, "footprint_teams", start, stop, jobs=False)
+    elif within_budget(con, "footprint_teams", start, stop):
+        rows = scan_usage(con, "footprint_teams", start, stop, checked=True,
+                          jobs=False)
+    else:
+        # Too many rows to scan: use the daily usage of users
+        stop = ceil2day(stop)
+        rows = rollup.iter_days(con, start, stop)
+
     activity = []
     _teams = {}
     day = day_ts = None
-    for dt_str, ts, users_data, _ in iter_usage(con, start, stop):
-        _day = dt_str[:8]
-
+    for ts, _day, users_data, _ in rows:
         if _day != day:
             if day_ts is not None:
                 activity.append({
@@ -321,7 +590,7 @@ async def get_daily_team_footprint(start: str | None = None,
 
     con.close()
 
-    return {
+    return ORJSONResponse({
         "data": {
             "activity": activity,
             "teams": list(teams.values())
@@ -329,58 +598,82 @@ async def get_daily_team_footprint(start: str | None = None,
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/distribution/cpu/", tags=["CPU"])
+@cached
 async def get_cpu_usage(start: str | None = None,
                         stop: str | None = None,
                         days: int = settings.days):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
     cpu_dist = [0] * 100
-    for dt_str, ts, _, jobs_data in iter_usage(con, start, stop):
-        for i, v in enumerate(jobs_data["done"]["cpueff"]):
+    snapshot = get_snapshot(con)
+    if snapshot is not None:
+        s = snapshot.slice(start, stop)
+        for i, v in enumerate(snapshot["cpueff"][s].sum(axis=0).tolist()):
             cpu_dist[i] += v
+    else:
+        for ts, day, _, dist in scan_usage(con, "cpu", start, stop,
+                                           users=False, jobs="$.done.cpueff"):
+            for i, v in enumerate(dist):
+                cpu_dist[i] += v
 
     con.close()
 
-    return {
+    return ORJSONResponse({
         "data": {
             "dist": cpu_dist,
         },
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/distribution/memory/", tags=["Memory"])
+@cached
 async def get_memory_usage(start: str | None = None,
                            stop: str | None = None,
                            days: int = settings.days):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
     co2e = cost = 0
     mem_dist = [0] * 100
-    for dt_str, ts, _, jobs_data in iter_usage(con, start, stop):
-        for i, v in enumerate(jobs_data["done"]["memeff"]["dist"]):
+    snapshot = get_snapshot(con)
+    if snapshot is not None:
+        s = snapshot.slice(start, stop)
+        for i, v in enumerate(snapshot["memeff"][s].sum(axis=0).tolist()):
             mem_dist[i] += v
 
-        co2e += jobs_data["done"]["memeff"]["co2e"]
-        cost += jobs_data["done"]["memeff"]["cost"]
+        co2e = snapshot["wasted_co2e"][s].sum().item()
+        cost = snapshot["wasted_cost"][s].sum().item()
+    else:
+        for ts, day, _, memeff in scan_usage(con, "memory", start, stop,
+                                             users=False,
+                                             jobs="$.done.memeff"):
+            for i, v in enumerate(memeff["dist"]):
+                mem_dist[i] += v
+
+            co2e += memeff["co2e"]
+            cost += memeff["cost"]
 
     con.close()
 
-    return {
+    return ORJSONResponse({
         "data": {
             "dist": mem_dist,
             "wasted": {
@@ -391,61 +684,88 @@ async def get_memory_usage(start: str | None = None,
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/distribution/runtime/", tags=["Runtimes"])
+@cached
 async def get_runtimes(start: str | None = None,
                        stop: str | None = None,
                        days: int = settings.days):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
     runtimes = [[label, 0] for label in RUNTIMES]
-    for dt_str, ts, _, jobs_data in iter_usage(con, start, stop):
-        for i, v in enumerate(jobs_data["done"]["runtimes"]):
+    snapshot = get_snapshot(con)
+    if snapshot is not None:
+        s = snapshot.slice(start, stop)
+        for i, v in enumerate(snapshot["runtimes"][s].sum(axis=0).tolist()):
             runtimes[i][1] += v
+    else:
+        for ts, day, _, dist in scan_usage(con, "runtime", start, stop,
+                                           users=False,
+                                           jobs="$.done.runtimes"):
+            for i, v in enumerate(dist):
+                runtimes[i][1] += v
 
     con.close()
 
-    return {
+    return ORJSONResponse({
         "data": {
             "dist": runtimes,
         },
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/statuses/", tags=["Statuses"])
+@cached
 async def get_job_statuses(start: str | None = None,
                            stop: str | None = None,
                            days: int = settings.days):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
     done = co2e = failed = memlim = wasted_co2e = wasted_cost = 0
     more1h = more1h_co2e = 0
-    for dt_str, ts, _, jobs_data in iter_usage(con, start, stop):
-        done += jobs_data["done"]["total"]
-        co2e += jobs_data["done"]["co2e"]
-        failed += jobs_data["failed"]["total"]
-        wasted_co2e += jobs_data["failed"]["co2e"]
-        wasted_cost += jobs_data["failed"]["cost"]
-        memlim += jobs_data["failed"]["memlim"]
-        more1h += jobs_data["failed"]["more1h"]["total"]
-        more1h_co2e += jobs_data["failed"]["more1h"]["co2e"]
+    snapshot = get_snapshot(con)
+    if snapshot is not None:
+        s = snapshot.slice(start, stop)
+        done = snapshot["done"][s].sum().item()
+        co2e = snapshot["done_co2e"][s].sum().item()
+        failed = snapshot["exit"][s].sum().item()
+        wasted_co2e = snapshot["exit_co2e"][s].sum().item()
+        wasted_cost = snapshot["exit_cost"][s].sum().item()
+        memlim = snapshot["exit_memlim"][s].sum().item()
+        more1h = snapshot["more1h"][s].sum().item()
+        more1h_co2e = snapshot["more1h_co2e"][s].sum().item()
+    else:
+        for ts, day, _, jobs_data in scan_usage(con, "statuses", start, stop,
+                                                users=False):
+            done += jobs_data["done"]["total"]
+            co2e += jobs_data["done"]["co2e"]
+            failed += jobs_data["failed"]["total"]
+            wasted_co2e += jobs_data["failed"]["co2e"]
+            wasted_cost += jobs_data["failed"]["cost"]
+            memlim += jobs_data["failed"]["memlim"]
+            more1h += jobs_data["failed"]["more1h"]["total"]
+            more1h_co2e += jobs_data["failed"]["more1h"]["co2e"]
 
     con.close()
 
-    return {
+    return ORJSONResponse({
         "data": {
             "done": {
                 "total": done,
@@ -463,9 +783,10 @@ async def get_job_statuses(start: str | None = None,
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/user/{uuid}/", tags=["User"])
@@ -484,9 +805,9 @@ async def sign_in(uuid: str):
             datetime.strptime(month, "%Y-%m").strftime("%B %Y")
         ))
 
-    return {
+    return ORJSONResponse({
         "meta": user
-    }
+    })
 
 
 @app.post("/user/", tags=["Sign up"])
@@ -524,7 +845,10 @@ async def sign_up(user: User):
     con.close()
 
     try:
-        send_email(login, recipient, to_email, uuid)
+        # Repeated reminders to the same recipient are only sent once
+        await run_in_threadpool(mailer.enqueue,
+                                make_emails(login, recipient, to_email, uuid),
+                                key=f"{to_email}:{login}")
     except Exception as exc:
         print(exc)
         raise HTTPException(status_code=500, detail={
@@ -533,12 +857,12 @@ async def sign_up(user: User):
             "detail": f"Could not send email to {user.email}"
         })
 
-    return {
+    return ORJSONResponse({
         "meta": {
             "email": to_email,
             "sponsor": bool(sponsor)
         }
-    }
+    })
 
 
 @app.get("/user/{uuid}/footprint/", tags=["User footprint"])
@@ -546,6 +870,7 @@ async def get_user_footprint(uuid: str, start: str | None = None,
                              stop: str | None = None,
                              days: int = settings.days):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
@@ -555,33 +880,66 @@ async def get_user_footprint(uuid: str, start: str | None = None,
     activity = []
     jobs = submitted = done = failed = memlim = co2e = cost = 0
     memdist = [0] * 5
-    for dt_str, ts, users_data, _ in iter_usage(con, start, stop):
-        try:
-            values = users_data[username]
-        except KeyError:
-            cores = mem = 0
-        else:
-            jobs += values["jobs"]
-            cores = values["cores"]
-            mem = values["memory"]
-            co2e += values["co2e"]
-            cost += values["cost"]
-            submitted += values["submitted"]
-            done += values["done"]
-            failed += values["failed"]["total"]
-            memlim += values["failed"]["memlim"]
-            for i, v in enumerate(values["memeff"]):
-                memdist[i] += v
-
-        activity.append({
-            "timestamp": ts,
-            "cores": cores,
-            "memory": mem,
-        })
+    snapshot = get_snapshot(con)
+    if snapshot is not None:
+        s = snapshot.slice(start, stop)
+        timestamps = snapshot["time"][s].tolist()
+        cores = [0] * len(timestamps)
+        memory = [0] * len(timestamps)
+        entries = snapshot.get_entries(username, s)
+        if entries is not None:
+            e, rows = entries
+            jobs = snapshot["user_jobs"][e].sum().item()
+            co2e = snapshot["user_co2e"][e].sum().item()
+            cost = snapshot["user_cost"][e].sum().item()
+            submitted = snapshot["user_submitted"][e].sum().item()
+            done = snapshot["user_done"][e].sum().item()
+            failed = snapshot["user_failed"][e].sum().item()
+            memlim = snapshot["user_memlim"][e].sum().item()
+            memdist = snapshot["user_memeff"][e].sum(axis=0).tolist()
+            for i, _cores, mem in zip(rows.tolist(),
+                                      snapshot["user_cores"][e].tolist(),
+                                      snapshot["user_memory"][e].tolist()):
+                cores[i] = _cores
+                memory[i] = mem
+
+        for ts, _cores, mem in zip(timestamps, cores, memory):
+            activity.append({
+                "timestamp": ts,
+                "cores": _cores,
+                "memory": mem,
+            })
+    else:
+        for ts, day, users_data, _ in scan_usage(con, "user_footprint",
+                                                 start, stop,
+                                                 users=[username],
+                                                 jobs=False):
+            try:
+                values = users_data[username]
+            except KeyError:
+                cores = mem = 0
+            else:
+                jobs += values["jobs"]
+                cores = values["cores"]
+                mem = values["memory"]
+                co2e += values["co2e"]
+                cost += values["cost"]
+                submitted += values["submitted"]
+                done += values["done"]
+                failed += values["failed"]["total"]
+                memlim += values["failed"]["memlim"]
+                for i, v in enumerate(values["memeff"]):
+                    memdist[i] += v
+
+            activity.append({
+                "timestamp": ts,
+                "cores": cores,
+                "memory": mem,
+            })
 
     con.close()
 
-    return {
+    return ORJSONResponse({
         "data": {
             "jobs": round(jobs),
             "done": done,
@@ -597,16 +955,33 @@ async def get_user_footprint(uuid: str, start: str | None = None,
         "meta": {
             "days": days,
             "start": start.strftime(DT_FMT),
-            "stop": stop.strftime(DT_FMT)
+            "stop": stop.strftime(DT_FMT),
+            "version": version
         }
-    }
+    })
 
 
 @app.get("/user/{uuid}/report/{month}/", tags=["User report"])
 async def get_user_report(uuid: str, month: str):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
+    closed = month < f"{version[:4]}-{version[4:6]}"
+    if closed:
+        # Kept by clients across data updates, until reports are rebuilt
+        version = get_version(con, reports=True)
+
+    cache_version = get_cache_version(con)
     user = get_user(con, uuid)
     username = user["login"]
+    try:
+        _version, body = cache["reports"][(username, month)]
+    except KeyError:
+        pass
+    else:
+        if _version == cache_version:
+            con.close()
+            return Response(content=body, media_type="application/json")
+
     row = con.execute("SELECT data FROM report WHERE login=? AND month=?",
                       [username, month]).fetchone()
 
@@ -694,20 +1069,35 @@ async def get_user_report(uuid: str, month: str):
         team["users"] = users
         data["teams"].append(team)
 
-    return {
+    response = ORJSONResponse({
         "data": data,
         "meta": {
-            "month": datetime.strptime(month, "%Y-%m").strftime("%B %Y")
+            "month": datetime.strptime(month, "%Y-%m").strftime("%B %Y"),
+            "version": version
         }
-    }
+    })
+
+    if closed:
+        # Closed month: keep the encoded response until the next update
+        # or report rebuild
+        reports = cache["reports"]
+        if len(reports) >= REPORTS_CACHE_SIZE:
+            del reports[next(iter(reports))]
+
+        reports[(username, month)] = (cache_version, response.body)
+
+    return response
 
 
 @app.get("/user/{uuid}/team/{team:path}/", tags=["Team activity"])
 async def get_team_activity(uuid: str, team: str,
                             start: str | None = None,
                             stop: str | None = None,
-                            days: int = settings.days):
+                            days: int = settings.days,
+                            columnar: bool = False,
+                            delta: bool = False):
     con = sqlite3.connect(settings.database)
+    version = get_version(con)
     start, stop = get_interval(con, start, stop, days)
     start = floor2hour(start)
     stop = floor2hour(stop)
@@ -727,13 +1117,16 @@ async def get_team_activity(uuid: str, team: str,
             team_users[u["id"]] = u["name"]
             teams_per_user[u["id"]] = len(u["teams"])
 
-    activity = []
+    timestamps = []
+    activity_cores = []
+    activity_memory = []
     footprint_per_day = []
     users = {}
     day = day_ts = None
-    for dt_str, ts, users_data, _ in iter_usage(con, start, stop):
-        _day = dt_str[:8]
-
+    for ts, _day, users_data, _ in scan_usage(con, "team_activity", start,
+                                              stop,
+                                              users=list(teams_per_user),
+                                              jobs=False):
         if _day != day:
             if day_ts is not None:
                 footprint_per_day.append({
@@ -771,11 +1164,9 @@ async def get_team_activity(uuid: str, team: str,
             ts_cores += cores
             ts_memory += memory
 
-        activity.append({
-            "timestamp": ts,
-            "cores": ts_cores,
-            "memory": ts_memory,
-        })
+        timestamps.append(ts)
+        activity_cores.append(ts_cores)
+        activity_memory.append(ts_memory)
 
     if day_ts is not None:
         footprint_per_day.append({
@@ -785,7 +1176,28 @@ async def get_team_activity(uuid: str, team: str,
 
     con.close()
 
-    return {
+    if delta:
+        activity = {
+            "timestamps": encode_series(timestamps),
+            "cores": encode_series(activity_cores, 2),
+            "memory": encode_series(activity_memory, 2)
+        }
+    elif columnar:
+        activity = {
+            "timestamps": timestamps,
+            "cores": activity_cores,
+            "memory": activity_memory
+        }
+    else:
+        activity = []
+        for i, ts in enumerate(timestamps):
+            activity.append({
+                "timestamp": ts,
+                "cores": activity_cores[i],
+                "memory": activity_memory[i],
+            })
+
+    return ORJSONResponse({
         "data": {
             "activity": activity,
             "footprint": footprint_per_day,
@@ -794,8 +1206,235 @@ async def get_team_activity(uuid: str, team: str,
             "days": days,
             "start": start.strftime(DT_FMT),
             "stop": stop.strftime(DT_FMT),
-            "users": team_users
+            "users": team_users,
+            "version": version
         }
+    })
+
+
+@app.get("/breakdown/", tags=["Breakdown"])
+async def get_breakdown(
+        metric: str = "co2e",
+        by: str = "user",
+        top: int | None = None,
+        start: str | None = None,
+        stop: str | None = None,
+        days: int = settings.days,
+        credentials: HTTPAuthorizationCredentials | None = Depends(bearer)
+):
+    check_token(credentials)
+
+    if metric not in METRICS:
+        raise HTTPException(status_code=400, detail={
+            "status": "400",
+            "title": "Bad Request",
+            "detail": f"'metric' query parameter must be one of: "
+                      f"{', '.join(METRICS)}"
+        })
+    elif by not in ("user", "team", "day", "week"):
+        raise HTTPException(status_code=400, detail={
+            "status": "400",
+            "title": "Bad Request",
+            "detail": "'by' query parameter must be one of: "
+                      "user, team, day, week"
+        })
+    elif top is not None and top < 1:
+        raise HTTPException(status_code=400, detail={
+            "status": "400",
+            "title": "Bad Request",
+            "detail": "'top' query parameter must be a positive integer"
+        })
+
+    con = sqlite3.connect(settings.database)
+    if not rollup.exists(con):
+        con.close()
+        raise HTTPException(status_code=503, detail={
+            "status": "503",
+            "title": "Service Unavailable",
+            "detail": "The daily usage has not been built"
+        })
+
+    start, stop = get_interval(con, start, stop, days)
+    # Daily usage: whole days only
+    start = floor2day(start)
+    stop = ceil2day(stop)
+    # Data end, to average cores over the time with data
+    end = min(stop, get_last_update(con))
+
+    column = METRICS[metric]
+    params = [int(start.strftime("%Y%m%d")), int(stop.strftime("%Y%m%d"))]
+    groups = {}
+    names = {}
+    if by in ("user", "team"):
+        rows = con.execute(
+            f"""
+            SELECT login, SUM({column})
+            FROM daily_usage
+            WHERE day >= ? AND day < ?
+            GROUP BY login
+            """,
+            params
+        )
+
+        if by == "user":
+            groups = dict(rows)
+            names = {u["id"]: u["name"] for u in load_users(con)}
+        else:
+            user2teams = {u["id"]: u["teams"] for u in load_users(con)}
+            for login, value in rows:
+                user_teams = user2teams.get(login, [])
+                for team in user_teams:
+                    try:
+                        groups[team] += value / len(user_teams)
+                    except KeyError:
+                        groups[team] = value / len(user_teams)
+
+        if metric == "cores":
+            minutes = max((end - start).total_seconds() / 60, 1)
+            for key in groups:
+                groups[key] /= minutes
+    else:
+        rows = con.execute(
+            f"""
+            SELECT day, SUM({column})
+            FROM daily_usage
+            WHERE day >= ? AND day < ?
+            GROUP BY day
+            """,
+            params
+        )
+
+        for day, value in rows:
+            dt = datetime.strptime(str(day), "%Y%m%d")
+            if by == "week":
+                dt -= timedelta(days=dt.weekday())
+
+            try:
+                groups[dt] += value
+            except KeyError:
+                groups[dt] = value
+
+        if metric == "cores":
+            length = timedelta(days=1 if by == "day" else 7)
+            for dt in groups:
+                minutes = (min(dt + length, end)
+                           - max(dt, start)).total_seconds() / 60
+                groups[dt] /= max(minutes, 1)
+
+        groups = {dt.strftime("%Y-%m-%d"): value
+                  for dt, value in groups.items()}
+
+    con.close()
+
+    if top is not None:
+        items = heapq.nlargest(top, groups.items(), key=lambda x: x[1])
+    elif by in ("user", "team"):
+        items = sorted(groups.items(), key=lambda x: -x[1])
+    else:
+        items = sorted(groups.items())
+
+    data = []
+    for key, value in items:
+        obj = {"id": key, "value": value}
+        if by == "user":
+            obj["name"] = names.get(key)
+
+        data.append(obj)
+
+    return ORJSONResponse({
+        "data": data,
+        "meta": {
+            "metric": metric,
+            "by": by,
+            "top": top,
+            "days": days,
+            "start": start.strftime(DT_FMT),
+            "stop": stop.strftime(DT_FMT)
+        }
+    })
+
+
+@app.get("/export/", tags=["Export"])
+async def export_usage(
+        start: str | None = None,
+        stop: str | None = None,
+        days: int = settings.days,
+        format: str = "csv",
+        per_user: bool = False,
+        compress: bool = False,
+        credentials: HTTPAuthorizationCredentials | None = Depends(bearer)
+):
+    check_token(credentials)
+
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail={
+            "status": "400",
+            "title": "Bad Request",
+            "detail": f"'format' query parameter must be one of: "
+                      f"{', '.join(export.FORMATS)}"
+        })
+
+    # Used by the threads streaming the response, one at a time
+    con = sqlite3.connect(settings.database, check_same_thread=False)
+    try:
+        start, stop = get_interval(con, start, stop, days)
+    except HTTPException:
+        con.close()
+        raise
+
+    def iter_chunks():
+        try:
+            yield from export.iter_chunks(con, start, stop, format, per_user,
+                                          compress)
+        finally:
+            con.close()
+
+    filename = (f"usage-{start.strftime(DT_FMT)}-{stop.strftime(DT_FMT)}"
+                f".{format}")
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+    elif format == "csv":
+        media_type = "text/csv"
+    else:
+        media_type = "application/x-ndjson"
+
+    # Chunks are produced as the client reads them
+    return StreamingResponse(iter_chunks(), media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+
+def check_token(credentials: HTTPAuthorizationCredentials | None):
+    if (settings.api_token is None or credentials is None or
+            not secrets.compare_digest(credentials.credentials,
+                                       settings.api_token)):
+        raise HTTPException(status_code=401, detail={
+            "status": "401",
+            "title": "Unauthorized",
+            "detail": "Invalid or missing API token"
+        })
+
+
+def encode_series(values: list, precision: int = 0) -> dict:
+    # Run-length encoded differences between consecutive values,
+    # as integers (values multiplied by the scale)
+    scale = 10 ** precision
+    runs = []
+    prev = 0
+    for value in values:
+        value = round(value * scale)
+        diff = value - prev
+        if runs and runs[-2] == diff:
+            runs[-1] += 1
+        else:
+            runs += [diff, 1]
+
+        prev = value
+
+    return {
+        "scale": scale,
+        "runs": runs
     }
 
 
@@ -877,6 +1516,11 @@ def floor2day(dt: datetime) -> datetime:
     return datetime(dt.year, dt.month, dt.day)
 
 
+def ceil2day(dt: datetime) -> datetime:
+    day = floor2day(dt)
+    return day if day == dt else day + timedelta(days=1)
+
+
 def get_interval(con: sqlite3.Connection, start: str | None, stop: str | None,
                  days: int) -> tuple[datetime, datetime]:
     if start and stop:
@@ -906,10 +1550,74 @@ def get_interval(con: sqlite3.Connection, start: str | None, stop: str | None,
     return start, stop
 
 
-def get_last_update(con: sqlite3.Connection) -> datetime:
-    time, = con.execute("SELECT value FROM metadata "
-                        "WHERE key = 'jobs'").fetchone()
-    return datetime.strptime(time, "%Y-%m-%d %H:%M:%S")
+def within_budget(con: sqlite3.Connection, route: str, start: datetime,
+                  stop: datetime) -> bool:
+    # Estimate the number of rows to scan, from the time index
+    budget = settings.scan_budgets.get(route, SCAN_BUDGETS[route])
+    return budget == 0 or count_usage(con, start, stop) <= budget
+
+
+def scan_usage(con: sqlite3.Connection, route: str, start: datetime,
+               stop: datetime, checked: bool = False, **kwargs):
+    # iter_usage(), rejecting scans over the route's budget (unless already
+    # checked by the caller) or time limit
+    if not checked and not within_budget(con, route, start, stop):
+        con.close()
+        raise HTTPException(status_code=400, detail={
+            "status": "400",
+            "title": "Bad Request",
+            "detail": "The requested time range is too large: "
+                      "please select a shorter range"
+        })
+
+    deadline = time.monotonic() + settings.scan_timeout
+    try:
+        yield from iter_usage(con, start, stop, deadline=deadline, **kwargs)
+    except sqlite3.OperationalError as exc:
+        if str(exc) != "interrupted":
+            raise
+
+        con.close()
+        raise HTTPException(status_code=503, detail={
+            "status": "503",
+            "title": "Service Unavailable",
+            "detail": "The query was aborted after "
+                      f"{settings.scan_timeout:g} seconds: "
+                      "please select a shorter range"
+        })
+
+
+def get_version(con: sqlite3.Connection, reports: bool = False) -> str:
+    # Version of the data, used by clients to invalidate cached responses
+    version = get_last_update(con).strftime(VERSION_FMT)
+    rebuilt = get_reports_version(con)
+    if reports and rebuilt is not None:
+        # Reports of closed months only change when rebuilt,
+        # or when a month starts
+        rebuilt = "".join(c for c in rebuilt if c.isdigit())
+        version = f"{version[:6]}-{rebuilt}"
+
+    return version
+
+
+def get_cache_version(con: sqlite3.Connection) -> tuple:
+    # Cached views are outdated by data updates and report rebuilds
+    return get_last_update(con), get_reports_version(con)
+
+
+def get_snapshot(con: sqlite3.Connection) -> Snapshot | None:
+    # Columnar snapshot, if any and up-to-date
+    if settings.snapshot:
+        try:
+            snapshot = load_snapshot(settings.snapshot)
+        except FileNotFoundError:
+            # Removed by a newer export while loading: read the database
+            return None
+
+        if snapshot is not None and snapshot.updated == get_last_update(con):
+            return snapshot
+
+    return None
 
 
 def get_user(con: sqlite3.Connection, uuid: str) -> dict:
@@ -933,38 +1641,8 @@ def get_user(con: sqlite3.Connection, uuid: str) -> dict:
     }
 
 
-def iter_usage(con: sqlite3.Connection, start: datetime, stop: datetime):
-    sql = """
-        SELECT time, users_data, jobs_data 
-        FROM usage
-        WHERE time >= ? AND time < ?
-        ORDER BY time
-    """
-    params = [start.strftime(DT_FMT), stop.strftime(DT_FMT)]
-    for row in con.execute(sql, params):
-        dt_str = row[0]
-        ts = math.floor(strptime(dt_str).timestamp()) * 1000
-        yield dt_str, ts, json.loads(row[1]), json.loads(row[2])
-
-
-def load_users(con: sqlite3.Connection) -> list[dict]:
-    data = []
-    for row in con.execute("SELECT login, name, teams, photo_url FROM user"):
-        data.append({
-            "id": row[0],
-            "name": row[1],
-            "teams": json.loads(row[2]),
-            "photoUrl": row[3]
-        })
-
-    return data
-
-
-def strptime(s: str) -> datetime:
-    return datetime.strptime(s, "%Y%m%d%H%M")
-
-
-def send_email(login: str, recipient: str, to_email: str, uuid: str):
+def make_emails(login: str, recipient: str, to_email: str,
+                uuid: str) -> list[EmailMessage]:
     content = f"""\
 Dear {recipient},
 
@@ -983,29 +1661,23 @@ The UUID is: {uuid}
     msg["From"] = settings.admin_email[0]
     msg["Date"] = formatdate(localtime=True)
     msg.set_content(content)
-
-    admin_email = settings.admin_email[0]
-
-    with SMTP(host=settings.smtp_host, port=settings.smtp_port) as server:
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        server.login(admin_email.split('@')[0], settings.admin_password)
-        server.send_message(msg)
-
-        if settings.notify_on_signup:
-            msg = EmailMessage()
-            msg["Subject"] = (f"EMBL-EBI carbon footprint: "
-                              f"UUID requested for {login}")
-            msg["To"] = admin_email
-            msg["From"] = admin_email
-            msg["Date"] = formatdate(localtime=True)
-            msg.set_content(
-                f"""\
+    messages = [msg]
+
+    if settings.notify_on_signup:
+        admin_email = settings.admin_email[0]
+        msg = EmailMessage()
+        msg["Subject"] = (f"EMBL-EBI carbon footprint: "
+                          f"UUID requested for {login}")
+        msg["To"] = admin_email
+        msg["From"] = admin_email
+        msg["Date"] = formatdate(localtime=True)
+        msg.set_content(
+            f"""\
 Someone asked for a UUID reminder:
 User: {login}
 Name: {recipient}
-                """
-            )
+            """
+        )
+        messages.append(msg)
 
-            server.send_message(msg)
+    return messages
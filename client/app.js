@@ -1,4 +1,5 @@
 import {showOverallActivity, showRecentActivity} from "./modules/activity.js";
+import {fetchCached, initCache} from "./modules/cache.js";
 import {
     showCPUDist,
     showRuntimes,
@@ -31,7 +32,8 @@ Highcharts.setOptions({
 
 document.addEventListener('DOMContentLoaded', () => {
     testApi(API_URL)
-        .then(({email, slack, updated}) => {
+        .then(async ({email, slack, updated, version, reportsVersion}) => {
+            await initCache(version, reportsVersion);
             initApp(API_URL, updated, email, slack);
         })
         .catch((error) => {
@@ -149,8 +151,7 @@ async function initApp(apiUrl, lastUpdated, contactEmail, contactSlack) {
 }
 
 async function plotJobStatuses(apiUrl) {
-    const response = await fetch(`${apiUrl}/statuses/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/statuses/`);
     document.querySelector('#status .count').innerHTML = (payload.data.done.total + payload.data.exit.total).toLocaleString();
     document.querySelector('#status .days').innerHTML = payload.meta.days;
 
@@ -1,5 +1,6 @@
+import {fetchCached} from "./cache.js";
 import {fetchTeamActivity} from "./team.js";
-import {renderCo2Emissions, renderCpuTime, round} from "./utils.js";
+import {decodeSeries, renderCo2Emissions, renderCpuTime, round} from "./utils.js";
 
 function updateOverallChart(categories, data, nSeries, othersOnTop) {
     const series = data.slice(0, nSeries);
@@ -66,8 +67,7 @@ function updateOverallChart(categories, data, nSeries, othersOnTop) {
 }
 
 async function showOverallActivity(apiUrl) {
-    const response = await fetch(`${apiUrl}/footprint/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/footprint/`);
 
     let teams = new Map();
 
@@ -133,8 +133,15 @@ async function showOverallActivity(apiUrl) {
 }
 
 async function showRecentActivity(apiUrl) {
-    const response = await fetch(`${apiUrl}/activity/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/activity/?delta=true`);
+    const activity = {
+        timestamps: decodeSeries(payload.data.activity.timestamps),
+        cores: decodeSeries(payload.data.activity.cores),
+        memory: decodeSeries(payload.data.activity.memory),
+        jobs: {
+            submitted: decodeSeries(payload.data.activity.jobs.submitted)
+        }
+    };
 
     document.querySelector('#activity .days').innerHTML = payload.meta.days;
 
@@ -197,18 +204,18 @@ async function showRecentActivity(apiUrl) {
         let yAxisTitle = undefined;
         switch (dataType) {
             case 'jobs':
-                getY = (x => x.jobs.submitted);
+                getY = (i => activity.jobs.submitted[i]);
                 title = 'Submitted jobs';
                 yAxisTitle = 'Jobs';
                 break
             case 'memory':
-                getY = (x => round(x.memory / 1024, 3))
+                getY = (i => round(activity.memory[i] / 1024, 3))
                 tooltipSuffix = ' TB';
                 title = 'Memory';
                 yAxisTitle = 'Memory (TB)';
                 break
             default:
-                getY = (x => x[dataType]);
+                getY = (i => activity[dataType][i]);
                 title = 'Cores';
                 yAxisTitle = 'Cores';
         }
@@ -248,8 +255,8 @@ async function showRecentActivity(apiUrl) {
             series: [{
                 name: 'Total',
                 color: '#a6cee3',
-                data: payload.data.activity.map((x) => {
-                    return [x.timestamp, getY(x)];
+                data: activity.timestamps.map((timestamp, i) => {
+                    return [timestamp, getY(i)];
                 }),
             }],
             tooltip: {
@@ -326,9 +333,10 @@ async function showRecentActivity(apiUrl) {
             .then((payload) => {
                 const coresData = [];
                 const memData = [];
-                payload.data.activity.forEach((value) => {
-                    coresData.push([value.timestamp, value.cores]);
-                    memData.push([value.timestamp, round(value.memory / 1024, 3)]);
+                const activity = payload.data.activity;
+                activity.timestamps.forEach((timestamp, i) => {
+                    coresData.push([timestamp, activity.cores[i]]);
+                    memData.push([timestamp, round(activity.memory[i] / 1024, 3)]);
                 });
 
                 charts[1].addSeries({
@@ -0,0 +1,145 @@
+const DB_NAME = 'ebi-co2e-cache';
+const STORE_NAME = 'responses';
+const MAX_SIZE = 20 * 1024 * 1024;  // Approximate size of cached payloads, in bytes
+
+let dataVersion = null;
+let reportsVersion = null;
+let dbPromise = null;
+
+function openDatabase() {
+    if (dbPromise === null) {
+        dbPromise = new Promise((resolve, reject) => {
+            const request = indexedDB.open(DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                const store = request.result.createObjectStore(STORE_NAME, {keyPath: 'url'});
+                store.createIndex('accessed', 'accessed');
+            };
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => reject(request.error);
+        }).catch(() => null);
+    }
+    return dbPromise;
+}
+
+function runRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function iterCursor(request, callback) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => {
+            const cursor = request.result;
+            if (cursor === null)
+                resolve();
+            else {
+                callback(cursor);
+                cursor.continue();
+            }
+        };
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function initCache(version, reports) {
+    // Responses of previous data versions are outdated,
+    // and reports of closed months are outdated by report rebuilds
+    dataVersion = version;
+    reportsVersion = reports || version;
+    const db = await openDatabase();
+    if (db === null)
+        return;
+
+    try {
+        const store = db.transaction(STORE_NAME, 'readwrite').objectStore(STORE_NAME);
+        await iterCursor(store.openCursor(), (cursor) => {
+            if (!isCurrent(cursor.value))
+                cursor.delete();
+        });
+    } catch (error) {
+        // Cache unavailable: data is fetched from the API
+    }
+}
+
+function isCurrent(record) {
+    return record.version === dataVersion || record.version === reportsVersion;
+}
+
+async function getRecord(db, url) {
+    try {
+        const store = db.transaction(STORE_NAME, 'readwrite').objectStore(STORE_NAME);
+        const record = await runRequest(store.get(url));
+        if (record === undefined || !isCurrent(record))
+            return null;
+
+        record.accessed = Date.now();
+        store.put(record);
+        return record;
+    } catch (error) {
+        return null;
+    }
+}
+
+async function putRecord(db, record) {
+    try {
+        const store = db.transaction(STORE_NAME, 'readwrite').objectStore(STORE_NAME);
+        await runRequest(store.put(record));
+
+        // Evict least recently used responses
+        let size = 0;
+        await iterCursor(store.index('accessed').openCursor(null, 'prev'), (cursor) => {
+            size += cursor.value.size;
+            if (size > MAX_SIZE)
+                cursor.delete();
+        });
+    } catch (error) {
+        // Quota exceeded, or cache unavailable: the response is not cached
+    }
+}
+
+async function fetchCached(url) {
+    const db = await openDatabase();
+    if (db !== null && dataVersion !== null) {
+        const record = await getRecord(db, url);
+        if (record !== null)
+            return {ok: true, payload: record.payload};
+    }
+
+    const response = await fetch(url);
+    const text = await response.text();
+    const payload = JSON.parse(text);
+    if (response.ok && db !== null && dataVersion !== null) {
+        // The data (or reports) may have been updated since the versions were fetched
+        const meta = payload.meta || {};
+        putRecord(db, {
+            url: url,
+            version: meta.version || dataVersion,
+            size: text.length,
+            accessed: Date.now(),
+            payload: payload
+        });
+    }
+
+    return {ok: response.ok, payload: payload};
+}
+
+async function clearCache(pattern) {
+    // Remove responses whose URL contains the given pattern
+    const db = await openDatabase();
+    if (db === null)
+        return;
+
+    try {
+        const store = db.transaction(STORE_NAME, 'readwrite').objectStore(STORE_NAME);
+        await iterCursor(store.openCursor(), (cursor) => {
+            if (cursor.primaryKey.includes(pattern))
+                cursor.delete();
+        });
+    } catch (error) {
+        // Cache unavailable
+    }
+}
+
+export {initCache, fetchCached, clearCache};
@@ -1,3 +1,4 @@
+import {fetchCached} from "./cache.js";
 import {renderCo2Emissions, renderCost, round} from "./utils.js";
 
 function plotMemoryDist(data, inMillions, elem) {
@@ -51,8 +52,7 @@ function plotMemoryDist(data, inMillions, elem) {
 }
 
 async function showMemoryDist(apiUrl) {
-    const response = await fetch(`${apiUrl}/distribution/memory/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/distribution/memory/`);
 
     document.querySelector('#memory .count').innerHTML = payload.data.dist
         .reduce((accumulator, currentValue) => accumulator + currentValue)
@@ -65,8 +65,7 @@ async function showMemoryDist(apiUrl) {
 }
 
 async function showCPUDist(apiUrl) {
-    const response = await fetch(`${apiUrl}/distribution/cpu/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/distribution/cpu/`);
 
     document.querySelector('#cpu .days').innerHTML = payload.meta.days;
 
@@ -117,8 +116,7 @@ async function showCPUDist(apiUrl) {
 }
 
 async function showRuntimes(apiUrl) {
-    const response = await fetch(`${apiUrl}/distribution/runtime/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/distribution/runtime/`);
 
     document.querySelector('#runtime .days').innerHTML = payload.meta.days;
     Highcharts.chart('runtimes-chart', {
@@ -1,10 +1,17 @@
+import {fetchCached} from "./cache.js";
 import {Table} from "./table.js";
-import {renderCo2Emissions, renderCost, round} from "./utils.js";
+import {decodeSeries, renderCo2Emissions, renderCost, round} from "./utils.js";
 import {TIMEZONE_OFFSET_MIN} from "./settings.js";
 
 async function fetchTeamActivity(apiUrl, uuid, team) {
-    const response = await fetch(`${apiUrl}/user/${uuid}/team/${encodeURIComponent(team)}/`);
-    return await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/user/${uuid}/team/${encodeURIComponent(team)}/?delta=true`);
+    const activity = payload.data.activity;
+    payload.data.activity = {
+        timestamps: decodeSeries(activity.timestamps),
+        cores: decodeSeries(activity.cores),
+        memory: decodeSeries(activity.memory)
+    };
+    return payload;
 }
 
 async function showTeamFootprint(apiUrl, userId, uuid, team, elemId) {
@@ -131,8 +138,7 @@ async function showTeamFootprint(apiUrl, userId, uuid, team, elemId) {
 }
 
 async function showTeamsFootprint(apiUrl) {
-    const response = await fetch(`${apiUrl}/footprint/teams/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/footprint/teams/`);
     const showTopNTeams = 15;
 
     const teams = payload.data.teams
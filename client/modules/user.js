@@ -1,3 +1,4 @@
+import {clearCache, fetchCached} from "./cache.js";
 import {plotMemoryDist} from "./distribution.js";
 import {SIGN_IN_KEY} from "./settings.js";
 import {showTeamFootprint} from "./team.js";
@@ -44,6 +45,8 @@ function signOut() {
         });
     }
 
+    clearCache('/user/');
+
     document.getElementById('uuid').className = '';
     document.querySelector('#details > form').style.display = null;
     document.getElementById('user-details').style.display = 'none';
@@ -51,9 +54,8 @@ function signOut() {
 }
 
 async function signIn(apiUrl, uuid) {
-    const response = await fetch(`${apiUrl}/user/${uuid}/`);
-    const payload = await response.json();
-    if (response.ok)
+    const {ok, payload} = await fetchCached(`${apiUrl}/user/${uuid}/`);
+    if (ok)
         return payload.meta;
 
     const error = payload.detail;
@@ -144,9 +146,50 @@ function switchSignForm(apiUrl) {
     MODAL.open();
 }
 
+function plotMemoryEfficiency(data, elem) {
+    // Jobs in 5 memory efficiency bins
+    Highcharts.chart(elem, {
+        chart: { type: 'column',},
+        series: [{
+            name: 'Jobs',
+            data: [{
+                name: '0-20%',
+                y: data[0],
+                color: '#f44336'
+            }, {
+                name: '20-40%',
+                y: data[1],
+                color: '#ff9800'
+            }, {
+                name: '40-60%',
+                y: data[2],
+                color: '#cddc39'
+            }, {
+                name: '60-80%',
+                y: data[3],
+                color: '#8bc34a'
+            },{
+                name: '80-100%',
+                y: data[4],
+                color: '#4caf50'
+            }]
+        }],
+        tooltip: {
+            shared: true,
+        },
+        xAxis: {
+            type: 'category',
+        },
+        yAxis: [{
+            title: {
+                text: 'Jobs'
+            },
+        }],
+    });
+}
+
 async function getUserReport(apiUrl, uuid, month) {
-    const response = await fetch(`${apiUrl}/user/${uuid}/report/${month}/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/user/${uuid}/report/${month}/`);
 
     const targetDiv = document.getElementById('user-report');
     let suffix = 'th';
@@ -253,7 +296,11 @@ async function getUserReport(apiUrl, uuid, month) {
         </table>        
     `;
 
-    plotMemoryDist(payload.data.memory, false, targetDiv.querySelector('.memory'));
+    // Reports built by report.py only have the 5-bin memory efficiency
+    if (payload.data.memory !== undefined)
+        plotMemoryDist(payload.data.memory, false, targetDiv.querySelector('.memory'));
+    else
+        plotMemoryEfficiency(payload.data.memeff, targetDiv.querySelector('.memory'));
 
     targetDiv.style.display = null;
     M.Tooltip.init(targetDiv.querySelector('.fa-circle-question'), {});
@@ -380,8 +427,7 @@ async function initUser(apiUrl, uuid, user, month) {
 }
 
 async function getUserActivity(apiUrl, uuid) {
-    const response = await fetch(`${apiUrl}/user/${uuid}/footprint/`);
-    const payload = await response.json();
+    const {payload} = await fetchCached(`${apiUrl}/user/${uuid}/footprint/`);
 
     document.querySelector('#user-info [data-info="footprint"]').innerHTML = `
         <span>
@@ -470,48 +516,7 @@ async function getUserActivity(apiUrl, uuid) {
         legend: { enabled: true },
     });
 
-    Highcharts.chart(document.querySelector('#user-memory > div'), {
-        chart: { type: 'column',},
-        // title: {
-        //     text: `Memory efficiency of jobs successfully completed in the past ${payload.meta.days} days`,
-        //     align: 'left'
-        // },
-        series: [{
-            name: 'Jobs',
-            data: [{
-                name: '0-20%',
-                y: payload.data.memory[0],
-                color: '#f44336'
-            }, {
-                name: '20-40%',
-                y: payload.data.memory[1],
-                color: '#ff9800'
-            }, {
-                name: '40-60%',
-                y: payload.data.memory[2],
-                color: '#cddc39'
-            }, {
-                name: '60-80%',
-                y: payload.data.memory[3],
-                color: '#8bc34a'
-            },{
-                name: '80-100%',
-                y: payload.data.memory[4],
-                color: '#4caf50'
-            }]
-        }],
-        tooltip: {
-            shared: true,
-        },
-        xAxis: {
-            type: 'category',
-        },
-        yAxis: [{
-            title: {
-                text: 'Jobs'
-            },
-        }],
-    });
+    plotMemoryEfficiency(payload.data.memory, document.querySelector('#user-memory > div'));
 
     Highcharts.chart(document.querySelector('#user-status > div'), {
         chart: {
@@ -3,6 +3,21 @@ function round(value, precision) {
     return Math.floor(value * f) / f;
 }
 
+function decodeSeries(series) {
+    // Run-length encoded differences between consecutive (scaled) values
+    const values = [];
+    let value = 0;
+    for (let i = 0; i < series.runs.length; i += 2) {
+        const diff = series.runs[i];
+        const count = series.runs[i + 1];
+        for (let j = 0; j < count; j++) {
+            value += diff;
+            values.push(value / series.scale);
+        }
+    }
+    return values;
+}
+
 function getValue(value, defaultValue) {
     if (value === undefined || value === null)
         return defaultValue;
@@ -64,4 +79,4 @@ function renderCpuTime(seconds) {
     return `${round(seconds, 0)} second${pluralize(seconds)}`;
 }
 
-export {round, getValue, renderCost, renderCo2Emissions, resetScrollspy, renderCpuTime};
\ No newline at end of file
+export {round, decodeSeries, getValue, renderCost, renderCo2Emissions, resetScrollspy, renderCpuTime};
\ No newline at end of file
@@ -0,0 +1,182 @@
+import argparse
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+from database import (DT_FMT, get_last_update, get_partitions, strptime,
+                      sum_values, to_timestamp, update_partition)
+from migrate import upgrade
+
+
+# Per-user values averaged over time instead of summed
+AVERAGED = ("cores", "memory")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge old usage rows "
+                                                 "into hourly and daily rows")
+    parser.add_argument("database", help="SQLite database")
+    parser.add_argument("--raw", type=int, default=90, metavar="DAYS",
+                        help="keep 15-minute rows for this number of days "
+                             "(default: 90)")
+    parser.add_argument("--hourly", type=int, default=730, metavar="DAYS",
+                        help="keep hourly rows for this number of days, "
+                             "older rows are merged by day (default: 730)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rebuild the main database file to reclaim the "
+                             "space of deleted rows (partitions are always "
+                             "rebuilt)")
+    args = parser.parse_args()
+
+    if args.raw < 0 or args.hourly < 0:
+        parser.error("number of days must be positive")
+
+    con = sqlite3.connect(args.database)
+    n = compact(con, args.raw, args.hourly)
+    print(f"{n} rows merged")
+
+    if args.vacuum:
+        con.execute("VACUUM")
+
+    con.close()
+
+
+def compact(con: sqlite3.Connection, raw_days: int, hourly_days: int) -> int:
+    last_update = get_last_update(con)
+    daily_cutoff = last_update - timedelta(days=hourly_days)
+    daily_cutoff = datetime(daily_cutoff.year, daily_cutoff.month,
+                            daily_cutoff.day)
+
+    if hourly_days > raw_days:
+        hourly_cutoff = last_update - timedelta(days=raw_days)
+        hourly_cutoff = datetime(hourly_cutoff.year, hourly_cutoff.month,
+                                 hourly_cutoff.day, hourly_cutoff.hour)
+    else:
+        hourly_cutoff = None
+
+    n = compact_usage(con, daily_cutoff, hourly_cutoff)
+
+    for month, path in sorted(get_partitions(con).items()):
+        if datetime.strptime(month, "%Y%m") < (hourly_cutoff or daily_cutoff):
+            n += compact_partition(path, daily_cutoff, hourly_cutoff)
+
+    return n
+
+
+def compact_usage(con: sqlite3.Connection, daily_cutoff: datetime,
+                  hourly_cutoff: datetime | None) -> int:
+    upgrade(con)
+    n = compact_range(con, daily_cutoff, 24 * 60)
+    if hourly_cutoff is not None:
+        n += compact_range(con, hourly_cutoff, 60)
+
+    return n
+
+
+def compact_partition(path: str, daily_cutoff: datetime,
+                      hourly_cutoff: datetime | None) -> int:
+    con = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+    sql = "SELECT COUNT(*) FROM usage WHERE time < ?"
+    params = [daily_cutoff.strftime(DT_FMT)]
+    columns = [row[1] for row in con.execute("PRAGMA table_info(usage)")]
+    if "span" in columns:
+        sql += " AND span < 1440"
+        if hourly_cutoff is not None:
+            sql += " OR time < ? AND span < 60"
+            params.append(hourly_cutoff.strftime(DT_FMT))
+    elif hourly_cutoff is not None:
+        params = [hourly_cutoff.strftime(DT_FMT)]
+
+    count, = con.execute(sql, params).fetchone()
+    con.close()
+    if count == 0:
+        return 0
+
+    return update_partition(
+        path,
+        lambda _con: compact_usage(_con, daily_cutoff, hourly_cutoff)
+    )
+
+
+def compact_range(con: sqlite3.Connection, cutoff: datetime,
+                  span: int) -> int:
+    row = con.execute("SELECT MIN(time) FROM usage WHERE span < ?",
+                      [span]).fetchone()
+    if row[0] is None:
+        return 0
+
+    n = 0
+    day = datetime.strptime(row[0][:8], "%Y%m%d")
+    while day < cutoff:
+        stop = min(day + timedelta(days=1), cutoff)
+        rows = con.execute(
+            """
+            SELECT time, span, users_data, jobs_data
+            FROM usage
+            WHERE time >= ? AND time < ? AND span < ?
+            ORDER BY time
+            """,
+            [day.strftime(DT_FMT), stop.strftime(DT_FMT), span]
+        ).fetchall()
+
+        buckets = {}
+        for dt_str, _span, users_data, jobs_data in rows:
+            if span == 60:
+                key = dt_str[:10] + "00"
+            else:
+                key = dt_str[:8] + "0000"
+
+            buckets.setdefault(key, []).append(
+                (dt_str, _span, json.loads(users_data), json.loads(jobs_data))
+            )
+
+        for key, bucket in buckets.items():
+            if len(bucket) == 1 and bucket[0][0] == key:
+                continue
+
+            merged = merge(bucket)
+            con.execute("DELETE FROM usage WHERE time IN ({})".format(
+                ','.join(['?' for _ in bucket])
+            ), [dt_str for dt_str, _, _, _ in bucket])
+            con.execute("INSERT INTO usage (time, ts, day, span, "
+                        "users_data, jobs_data) VALUES (?, ?, ?, ?, ?, ?)",
+                        [key, to_timestamp(strptime(key)), int(key[:8]),
+                         merged[0], json.dumps(merged[1]),
+                         json.dumps(merged[2])])
+            n += len(bucket)
+
+        day = stop
+        if day.day == 1 or day >= cutoff:
+            # Commit month by month
+            con.commit()
+
+    con.commit()
+    return n
+
+
+def merge(rows: list[tuple[str, int, dict, dict]]) -> tuple[int, dict, dict]:
+    span = sum(_span for _, _span, _, _ in rows)
+    users_data = {}
+    jobs_data = {}
+    for _, _span, _users_data, _jobs_data in rows:
+        sum_values(jobs_data, _jobs_data)
+
+        for login, values in _users_data.items():
+            try:
+                obj = users_data[login]
+            except KeyError:
+                obj = users_data[login] = {key: 0 for key in AVERAGED}
+
+            for key, value in values.items():
+                if key in AVERAGED:
+                    # Users not in a row used no resource during its span
+                    obj[key] += value * _span / span
+                else:
+                    sum_values(obj, {key: value})
+
+    return span, users_data, jobs_data
+
+
+if __name__ == "__main__":
+    main()
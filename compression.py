@@ -0,0 +1,135 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Responses that are already compressed
+COMPRESSED_TYPES = ("application/gzip",)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024,
+                 gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            encoding = get_encoding(headers.get("Accept-Encoding", ""))
+            if encoding is not None:
+                responder = Responder(self, encoding, send)
+                await self.app(scope, receive, responder.send)
+                return
+
+        await self.app(scope, receive, send)
+
+    def get_compressor(self, encoding: str):
+        if encoding == "br":
+            return BrotliCompressor(self.brotli_quality)
+        else:
+            return GzipCompressor(self.gzip_level)
+
+
+class Responder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str,
+                 send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.initial_message = None
+        self.compressor = None
+        self.started = False
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Wait for the first body message to decide. Headers are copied:
+            # responses may send the same list each time (raw_headers)
+            self.initial_message = {**message,
+                                    "headers": list(message["headers"])}
+            return
+        elif message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            if ("content-encoding" not in headers
+                    and not headers.get("content-type", "").startswith(
+                        COMPRESSED_TYPES)
+                    and (more_body
+                         or len(body) >= self.middleware.minimum_size)):
+                self.compressor = self.middleware.get_compressor(
+                    self.encoding
+                )
+                headers["Content-Encoding"] = self.encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+
+            if self.compressor is not None and not more_body:
+                body = self.compressor.compress(body, True)
+                headers["Content-Length"] = str(len(body))
+                message = {**message, "body": body}
+
+            await self._send(self.initial_message)
+            if self.compressor is not None and more_body:
+                message = {**message,
+                           "body": self.compressor.compress(body, False)}
+        elif self.compressor is not None:
+            message = {**message,
+                       "body": self.compressor.compress(body, not more_body)}
+
+        await self._send(message)
+
+
+class GzipCompressor:
+    def __init__(self, level: int):
+        self.obj = zlib.compressobj(level, wbits=31)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        # Streamed chunks are flushed, so clients can decode them as they come
+        mode = zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+        return self.obj.compress(data) + self.obj.flush(mode)
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int):
+        self.obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, last: bool) -> bytes:
+        data = self.obj.process(data)
+        return data + (self.obj.finish() if last else self.obj.flush())
+
+
+def get_encoding(accept_encoding: str) -> str | None:
+    # Preferred encoding accepted by the client: br (if available), or gzip
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        try:
+            q = float(params.strip()[2:]) if params.strip() else 1
+        except ValueError:
+            q = 1
+
+        if q > 0:
+            accepted.add(coding)
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    elif "gzip" in accepted:
+        return "gzip"
+
+    return None
@@ -0,0 +1,254 @@
+import json
+import math
+import os
+import sqlite3
+import time
+from datetime import datetime
+from urllib.parse import quote
+
+
+DT_FMT = "%Y%m%d%H%M"
+# Memory-mapped I/O for (read-only) partitions
+MMAP_SIZE = 256 * 1024 * 1024
+# SQLite virtual machine instructions between two deadline checks
+PROGRESS_STEPS = 10000
+
+
+def get_last_update(con: sqlite3.Connection) -> datetime:
+    time, = con.execute("SELECT value FROM metadata "
+                        "WHERE key = 'jobs'").fetchone()
+    return datetime.strptime(time, "%Y-%m-%d %H:%M:%S")
+
+
+def get_reports_version(con: sqlite3.Connection) -> str | None:
+    # Time of the last report rebuild, if any
+    row = con.execute("SELECT value FROM metadata "
+                      "WHERE key = 'reports'").fetchone()
+    return row[0] if row else None
+
+
+def get_usage_start(con: sqlite3.Connection) -> datetime | None:
+    # Time of the first usage row, or start of the first partition's month
+    months = sorted(get_partitions(con))
+    if months:
+        return datetime.strptime(months[0], "%Y%m")
+
+    row = con.execute("SELECT MIN(time) FROM usage").fetchone()
+    return strptime(row[0]) if row[0] is not None else None
+
+
+def get_partitions_dir(database: str) -> str:
+    return f"{database}.d"
+
+
+def get_partition_path(database: str, month: datetime) -> str:
+    return os.path.join(get_partitions_dir(database),
+                        f"usage-{month.strftime('%Y%m')}.sqlite")
+
+
+def get_partitions(con: sqlite3.Connection) -> dict[str, str]:
+    # Closed months of usage data moved to their own database file
+    partitions = {}
+    for _, name, database in con.execute("PRAGMA database_list"):
+        if name == "main" and database:
+            try:
+                entries = os.scandir(get_partitions_dir(database))
+            except FileNotFoundError:
+                break
+
+            with entries:
+                for entry in entries:
+                    if (entry.name.startswith("usage-")
+                            and entry.name.endswith(".sqlite")):
+                        partitions[entry.name[6:12]] = entry.path
+
+            break
+
+    return partitions
+
+
+def connect_partition(path: str) -> sqlite3.Connection:
+    # Read-only: can be used by the threads of a streamed response
+    con = sqlite3.connect(f"file:{quote(path)}?mode=ro&immutable=1",
+                          uri=True, check_same_thread=False)
+    con.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return con
+
+
+def set_deadline(con: sqlite3.Connection, deadline: float | None):
+    # Interrupt queries still running at the deadline (time.monotonic())
+    if deadline is None:
+        con.set_progress_handler(None, 0)
+    else:
+        con.set_progress_handler(lambda: time.monotonic() > deadline,
+                                 PROGRESS_STEPS)
+
+
+def update_partition(path: str, func) -> int:
+    # Partitions are immutable: update a copy, then replace the file
+    tmp_path = f"{path}.tmp"
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+    con = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+    con.execute("VACUUM INTO ?", [tmp_path])
+    con.close()
+
+    con = sqlite3.connect(tmp_path)
+    n = func(con)
+    con.execute("VACUUM")
+    con.close()
+
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, path)
+    return n
+
+
+def iter_usage(con: sqlite3.Connection, start: datetime, stop: datetime,
+               users: bool | list[str] = True, jobs: bool | str = True,
+               deadline: float | None = None):
+    # users: all users data (True), none (False), or only the given logins
+    # jobs: all jobs data (True), none (False), or the value at a JSON path
+    for _con, _start, _stop in iter_sources(con, start, stop, deadline):
+        yield from _iter_usage(_con, _start, _stop, users, jobs)
+
+
+def count_usage(con: sqlite3.Connection, start: datetime,
+                stop: datetime) -> int:
+    n = 0
+    for _con, _start, _stop in iter_sources(con, start, stop):
+        n += _con.execute("SELECT COUNT(*) FROM usage "
+                          "WHERE ts >= ? AND ts < ?",
+                          [to_timestamp(_start),
+                           to_timestamp(_stop)]).fetchone()[0]
+
+    return n
+
+
+def iter_sources(con: sqlite3.Connection, start: datetime, stop: datetime,
+                 deadline: float | None = None):
+    # Connections and time ranges to query, in chronological order
+    if deadline is not None:
+        set_deadline(con, deadline)
+
+    try:
+        partitions = get_partitions(con)
+        main_start = None
+        month = datetime(start.year, start.month, 1)
+        while month < stop:
+            next_month = get_next_month(month)
+
+            try:
+                path = partitions[month.strftime("%Y%m")]
+            except KeyError:
+                if main_start is None:
+                    main_start = max(month, start)
+            else:
+                if main_start is not None:
+                    yield con, main_start, month
+                    main_start = None
+
+                part_con = connect_partition(path)
+                set_deadline(part_con, deadline)
+                try:
+                    yield part_con, max(month, start), min(next_month, stop)
+                finally:
+                    part_con.close()
+
+            month = next_month
+
+        if main_start is not None:
+            yield con, main_start, stop
+    finally:
+        if deadline is not None:
+            # Connection of the caller, used for other queries
+            set_deadline(con, None)
+
+
+def _iter_usage(con: sqlite3.Connection, start: datetime, stop: datetime,
+                users: bool | list[str], jobs: bool | str):
+    params = []
+    if users is True:
+        users_col = "users_data"
+    elif users is False:
+        users_col = "NULL"
+    else:
+        # Decode the data of the selected users only
+        users_col = f"""
+            (SELECT json_group_object(key, json(value))
+             FROM json_each(users_data)
+             WHERE key IN ({','.join(['?' for _ in users])}))
+        """
+        params += users
+
+    if jobs is True:
+        jobs_col = "jobs_data"
+    elif jobs is False:
+        jobs_col = "NULL"
+    else:
+        jobs_col = "json_extract(jobs_data, ?)"
+        params.append(jobs)
+
+    sql = f"""
+        SELECT ts, day, {users_col}, {jobs_col}
+        FROM usage
+        WHERE ts >= ? AND ts < ?
+        ORDER BY ts
+    """
+    params += [to_timestamp(start), to_timestamp(stop)]
+    for ts, day, users_data, jobs_data in con.execute(sql, params):
+        if users is not False:
+            users_data = json.loads(users_data)
+
+        if isinstance(jobs_data, str):
+            # json_extract() returns scalars as SQL values
+            jobs_data = json.loads(jobs_data)
+
+        yield ts, day, users_data, jobs_data
+
+
+def get_next_month(dt: datetime) -> datetime:
+    if dt.month < 12:
+        return datetime(dt.year, dt.month + 1, 1)
+    else:
+        return datetime(dt.year + 1, 1, 1)
+
+
+def load_users(con: sqlite3.Connection) -> list[dict]:
+    data = []
+    for row in con.execute("SELECT login, name, teams, photo_url FROM user"):
+        data.append({
+            "id": row[0],
+            "name": row[1],
+            "teams": json.loads(row[2]),
+            "photoUrl": row[3]
+        })
+
+    return data
+
+
+def strptime(s: str) -> datetime:
+    return datetime.strptime(s, DT_FMT)
+
+
+def to_timestamp(dt: datetime) -> int:
+    return math.floor(dt.timestamp()) * 1000
+
+
+def sum_values(dst: dict, src: dict):
+    # Add (recursively) the values of `src` to `dst`
+    for key, value in src.items():
+        if isinstance(value, dict):
+            sum_values(dst.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            try:
+                values = dst[key]
+            except KeyError:
+                dst[key] = list(value)
+            else:
+                for i, v in enumerate(value):
+                    values[i] += v
+        else:
+            dst[key] = dst.get(key, 0) + value
@@ -0,0 +1,175 @@
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+import zlib
+from datetime import datetime
+
+from database import (get_last_update, get_usage_start, iter_sources,
+                      strptime, to_timestamp)
+from snapshot import get_value
+
+
+FORMATS = ("csv", "jsonl")
+# Exported per-user values, and their keys in the usage data
+COLUMNS = {
+    "jobs": ("jobs",),
+    "cores": ("cores",),
+    "memory": ("memory",),
+    "co2e": ("co2e",),
+    "cost": ("cost",),
+    "cputime": ("cputime",),
+    "submitted": ("submitted",),
+    "done": ("done",),
+    "failed": ("failed", "total"),
+    "memlim": ("failed", "memlim")
+}
+# Bytes buffered before a chunk is emitted
+CHUNK_SIZE = 64 * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export usage data "
+                                                 "as CSV or JSON Lines")
+    parser.add_argument("database", help="SQLite database")
+    parser.add_argument("output", nargs="?",
+                        help="output file (default: standard output)")
+    parser.add_argument("--start", metavar="YYYYMMDDHHMM",
+                        help="start of the export (default: first row)")
+    parser.add_argument("--stop", metavar="YYYYMMDDHHMM",
+                        help="end of the export, excluded "
+                             "(default: latest update)")
+    parser.add_argument("-f", "--format", choices=FORMATS, default="csv",
+                        help="output format (default: csv)")
+    parser.add_argument("--per-user", action="store_true",
+                        help="one record per user and time "
+                             "(default: one record per time)")
+    parser.add_argument("-z", "--gzip", action="store_true",
+                        help="compress the output")
+    args = parser.parse_args()
+
+    try:
+        start = strptime(args.start) if args.start else None
+        stop = strptime(args.stop) if args.stop else None
+    except ValueError:
+        parser.error("invalid time format (expected: YYYYMMDDHHMM)")
+
+    con = sqlite3.connect(args.database)
+    if stop is None:
+        stop = get_last_update(con)
+
+    if start is None:
+        start = get_usage_start(con) or stop
+
+    if args.output:
+        fh = open(args.output, "wb")
+    else:
+        fh = sys.stdout.buffer
+
+    try:
+        for chunk in iter_chunks(con, start, stop, args.format, args.per_user,
+                                 args.gzip):
+            fh.write(chunk)
+    finally:
+        if fh is not sys.stdout.buffer:
+            fh.close()
+
+        con.close()
+
+
+def get_fields(per_user: bool) -> list[str]:
+    fields = ["time"]
+    if per_user:
+        fields.append("login")
+
+    # Duration (in minutes) covered by the row: 15, or more once compacted
+    return fields + ["span"] + list(COLUMNS)
+
+
+def iter_records(con: sqlite3.Connection, start: datetime, stop: datetime,
+                 per_user: bool = False):
+    for time, span, users_data in iter_rows(con, start, stop):
+        users_data = json.loads(users_data)
+        if per_user:
+            for login, values in sorted(users_data.items()):
+                record = {"time": time, "login": login, "span": span}
+                for name, keys in COLUMNS.items():
+                    record[name] = get_value(values, keys)
+
+                yield record
+        else:
+            record = {"time": time, "span": span}
+            for name in COLUMNS:
+                record[name] = 0
+
+            for values in users_data.values():
+                for name, keys in COLUMNS.items():
+                    record[name] += get_value(values, keys)
+
+            yield record
+
+
+def iter_rows(con: sqlite3.Connection, start: datetime, stop: datetime):
+    for _con, _start, _stop in iter_sources(con, start, stop):
+        yield from _con.execute(
+            """
+            SELECT time, span, users_data
+            FROM usage
+            WHERE ts >= ? AND ts < ?
+            ORDER BY ts
+            """,
+            [to_timestamp(_start), to_timestamp(_stop)]
+        )
+
+
+def iter_lines(records, fmt: str, fields: list[str]):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(fields)
+        yield buffer.getvalue()
+        for record in records:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([record[field] for field in fields])
+            yield buffer.getvalue()
+    else:
+        for record in records:
+            yield json.dumps(record) + "\n"
+
+
+def iter_chunks(con: sqlite3.Connection, start: datetime, stop: datetime,
+                fmt: str = "csv", per_user: bool = False,
+                compress: bool = False):
+    # Rows are read, encoded, and emitted one chunk at a time
+    records = iter_records(con, start, stop, per_user)
+    lines = iter_lines(records, fmt, get_fields(per_user))
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        if compressor is not None:
+            data = compressor.compress(data)
+
+        if data:
+            chunk.append(data)
+            size += len(data)
+
+        if size >= CHUNK_SIZE:
+            yield b"".join(chunk)
+            chunk = []
+            size = 0
+
+    if compressor is not None:
+        chunk.append(compressor.flush())
+
+    if chunk:
+        yield b"".join(chunk)
+
+
+if __name__ == "__main__":
+    main()
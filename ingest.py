@@ -0,0 +1,144 @@
+import argparse
+import json
+import sqlite3
+import sys
+from datetime import datetime
+
+import rollup
+from database import get_partitions, strptime, to_timestamp
+from migrate import upgrade
+
+
+# Functions keeping derived tables in sync with `usage`.
+# They are called with the connection and the new rows, as
+# (time, users_data, jobs_data) tuples, within the ingestion transaction.
+DERIVED = [
+    rollup.ingest
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append usage rows "
+                                                 "to the database")
+    parser.add_argument("database", help="SQLite database")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="JSON Lines file of usage rows, with the 'time' "
+                             "(YYYYMMDDHHMM), 'users_data' and 'jobs_data' "
+                             "keys (default: standard input)")
+    parser.add_argument("--updated", metavar="YYYY-MM-DD HH:MM:SS",
+                        help="date and time of the data update "
+                             "(default: now)")
+    args = parser.parse_args()
+
+    if args.updated:
+        try:
+            updated = datetime.strptime(args.updated, "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            parser.error(f"invalid date: {args.updated}")
+    else:
+        updated = datetime.now().replace(microsecond=0)
+
+    try:
+        if args.input == "-":
+            rows = load_rows(sys.stdin)
+        else:
+            with open(args.input, "rt") as fh:
+                rows = load_rows(fh)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    con = connect(args.database)
+    upgrade(con)
+    try:
+        ingest(con, rows, updated)
+    except ValueError as exc:
+        parser.error(str(exc))
+    finally:
+        con.close()
+
+    print(f"{len(rows)} rows ingested")
+
+
+def connect(database: str) -> sqlite3.Connection:
+    con = sqlite3.connect(database)
+    # Persistent: API readers are not blocked while new data is written
+    con.execute("PRAGMA journal_mode = WAL")
+    con.execute("PRAGMA synchronous = NORMAL")
+    return con
+
+
+def load_rows(fh) -> list[tuple[str, dict, dict]]:
+    rows = []
+    for i, line in enumerate(fh, start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"line {i}: invalid JSON: {exc}")
+
+        try:
+            rows.append((obj["time"], obj["users_data"], obj["jobs_data"]))
+        except (KeyError, TypeError):
+            raise ValueError(f"line {i}: expected an object with the 'time', "
+                             f"'users_data' and 'jobs_data' keys")
+
+    return rows
+
+
+def ingest(con: sqlite3.Connection, rows: list[tuple[str, dict, dict]],
+           updated: datetime):
+    rows = sorted(rows, key=lambda x: x[0])
+    for i, (dt_str, _, _) in enumerate(rows):
+        try:
+            strptime(dt_str)
+        except ValueError:
+            raise ValueError(f"invalid time: {dt_str} "
+                             f"(expected: YYYYMMDDHHMM)")
+
+        if i > 0 and dt_str == rows[i - 1][0]:
+            raise ValueError(f"duplicated time: {dt_str}")
+
+    # Hold the write lock: checks are not invalidated by concurrent loads
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        if rows:
+            partitions = get_partitions(con)
+            for month in sorted({dt_str[:6] for dt_str, _, _ in rows}):
+                if month in partitions:
+                    raise ValueError(f"cannot append rows to {month}: "
+                                     f"month already partitioned")
+
+            last, = con.execute("SELECT MAX(time) FROM usage").fetchone()
+            if last is not None and rows[0][0] <= last:
+                raise ValueError(f"cannot append rows from {rows[0][0]}: "
+                                 f"usage data already ends at {last}")
+
+            con.executemany(
+                "INSERT INTO usage (time, ts, day, users_data, jobs_data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(dt_str, to_timestamp(strptime(dt_str)), int(dt_str[:8]),
+                  json.dumps(users_data), json.dumps(jobs_data))
+                 for dt_str, users_data, jobs_data in rows]
+            )
+
+            for func in DERIVED:
+                func(con, rows)
+
+        updated = updated.strftime("%Y-%m-%d %H:%M:%S")
+        cur = con.execute("UPDATE metadata SET value = ? WHERE key = 'jobs'",
+                          [updated])
+        if cur.rowcount == 0:
+            con.execute("INSERT INTO metadata (key, value) "
+                        "VALUES ('jobs', ?)", [updated])
+    except Exception:
+        con.rollback()
+        raise
+    else:
+        con.commit()
+
+
+if __name__ == "__main__":
+    main()
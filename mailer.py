@@ -0,0 +1,209 @@
+import asyncio
+import json
+import smtplib
+import sqlite3
+import time
+from email.message import EmailMessage
+
+from fastapi.concurrency import run_in_threadpool
+
+
+# Seconds before a failed message is retried, doubled after each attempt
+RETRY_DELAY = 60
+MAX_ATTEMPTS = 8
+# Seconds a worker has to send the messages it claimed
+LEASE = 300
+
+
+class Mailer:
+    def __init__(self, path: str, host: str, port: int, username: str,
+                 password: str, starttls: bool = True,
+                 dedup_window: int = 3600, interval: int = 10):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.dedup_window = dedup_window
+        self.interval = interval
+        self.server = None
+        self.loop = None
+        self.event = None
+
+        con = self.connect()
+        with con:
+            con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS message (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT,
+                    sender TEXT NOT NULL,
+                    recipients TEXT NOT NULL,
+                    data BLOB NOT NULL,
+                    created REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL,
+                    sent REAL,
+                    error TEXT
+                )
+                """
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS message_next_attempt "
+                        "ON message (next_attempt)")
+            con.execute("CREATE INDEX IF NOT EXISTS message_key "
+                        "ON message (key, created)")
+        con.close()
+
+    def connect(self) -> sqlite3.Connection:
+        # Shared by all API workers
+        con = sqlite3.connect(self.path, timeout=10)
+        con.execute("PRAGMA journal_mode = WAL")
+        return con
+
+    def enqueue(self, messages: list[EmailMessage],
+                key: str | None = None) -> bool:
+        # Messages with the same key are only queued once per window
+        now = time.time()
+        con = self.connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            if key is not None:
+                row = con.execute("SELECT COUNT(*) FROM message "
+                                  "WHERE key = ? AND created >= ?",
+                                  [key, now - self.dedup_window]).fetchone()
+                if row[0] > 0:
+                    con.rollback()
+                    return False
+
+            con.executemany(
+                """
+                INSERT INTO message (key, sender, recipients, data, created,
+                                     next_attempt)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(key, msg["From"], json.dumps([msg["To"]]), msg.as_bytes(),
+                  now, now) for msg in messages]
+            )
+            con.execute("DELETE FROM message "
+                        "WHERE next_attempt IS NULL AND created < ?",
+                        [now - max(self.dedup_window, 7 * 24 * 3600)])
+            con.commit()
+        finally:
+            con.close()
+
+        if self.event is not None:
+            # Called from a worker thread: wake up the loop of run()
+            self.loop.call_soon_threadsafe(self.event.set)
+
+        return True
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        try:
+            while True:
+                try:
+                    await run_in_threadpool(self.dispatch)
+                except Exception as exc:
+                    print(exc)
+
+                try:
+                    await asyncio.wait_for(self.event.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                self.event.clear()
+        finally:
+            self.close()
+
+    def dispatch(self) -> int:
+        n = 0
+        for msg_id, sender, recipients, data, attempts in self.claim():
+            try:
+                self.send(sender, json.loads(recipients), data)
+            except Exception as exc:
+                attempts += 1
+                if attempts < MAX_ATTEMPTS:
+                    next_attempt = (time.time()
+                                    + RETRY_DELAY * 2 ** (attempts - 1))
+                else:
+                    next_attempt = None
+
+                self.update(msg_id, attempts, next_attempt, None, str(exc))
+            else:
+                self.update(msg_id, attempts + 1, None, time.time(), None)
+                n += 1
+
+        return n
+
+    def claim(self) -> list[tuple]:
+        # Lease due messages so other workers don't send them too
+        now = time.time()
+        con = self.connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            rows = con.execute("SELECT id, sender, recipients, data, attempts "
+                               "FROM message WHERE next_attempt <= ? "
+                               "ORDER BY next_attempt", [now]).fetchall()
+            con.executemany("UPDATE message SET next_attempt = ? "
+                            "WHERE id = ?",
+                            [(now + LEASE, row[0]) for row in rows])
+            con.commit()
+        finally:
+            con.close()
+
+        return rows
+
+    def update(self, msg_id: int, attempts: int, next_attempt: float | None,
+               sent: float | None, error: str | None):
+        con = self.connect()
+        with con:
+            con.execute("UPDATE message SET attempts = ?, next_attempt = ?, "
+                        "sent = ?, error = ? WHERE id = ?",
+                        [attempts, next_attempt, sent, error, msg_id])
+        con.close()
+
+    def send(self, sender: str, recipients: list[str], data: bytes):
+        try:
+            server = self.get_server()
+            server.sendmail(sender, recipients, data)
+        except smtplib.SMTPServerDisconnected:
+            # Reconnect once: the server may have closed an idle session
+            self.close()
+            server = self.get_server()
+            server.sendmail(sender, recipients, data)
+
+    def get_server(self) -> smtplib.SMTP:
+        if self.server is not None:
+            try:
+                self.server.noop()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+
+        if self.server is None:
+            server = smtplib.SMTP(host=self.host, port=self.port, timeout=30)
+            try:
+                server.ehlo()
+                if self.starttls:
+                    server.starttls()
+                    server.ehlo()
+
+                if server.has_extn("auth"):
+                    server.login(self.username, self.password)
+            except Exception:
+                server.close()
+                raise
+
+            self.server = server
+
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+
+            self.server = None
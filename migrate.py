@@ -0,0 +1,98 @@
+import argparse
+import sqlite3
+from urllib.parse import quote
+
+from database import get_partitions, strptime, to_timestamp, update_partition
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade the schema of the "
+                                                 "usage table")
+    parser.add_argument("database", help="SQLite database")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.database)
+    n = upgrade(con)
+    for month, path in sorted(get_partitions(con).items()):
+        part_con = sqlite3.connect(f"file:{quote(path)}?mode=ro", uri=True)
+        done = is_upgraded(part_con)
+        part_con.close()
+        if not done:
+            n += update_partition(path, upgrade)
+
+    con.close()
+    print(f"{n} rows upgraded")
+
+
+def is_upgraded(con: sqlite3.Connection) -> bool:
+    row = con.execute("SELECT COUNT(*) FROM sqlite_master "
+                      "WHERE type = 'index' AND name = 'usage_ts_day' "
+                      "OR type = 'trigger' AND name = 'usage_set_ts_day'")
+    return row.fetchone()[0] == 2
+
+
+def upgrade(con: sqlite3.Connection, batch_size: int = 10000) -> int:
+    columns = [row[1] for row in con.execute("PRAGMA table_info(usage)")]
+    with con:
+        if "span" not in columns:
+            # Duration (in minutes) covered by each row
+            con.execute("ALTER TABLE usage "
+                        "ADD COLUMN span INTEGER NOT NULL DEFAULT 15")
+
+        if "ts" not in columns:
+            # Epoch time, in milliseconds
+            con.execute("ALTER TABLE usage ADD COLUMN ts INTEGER")
+
+        if "day" not in columns:
+            # YYYYMMDD
+            con.execute("ALTER TABLE usage ADD COLUMN day INTEGER")
+
+    n = 0
+    while True:
+        rows = con.execute("SELECT rowid, time FROM usage "
+                           "WHERE ts IS NULL OR day IS NULL "
+                           "LIMIT ?", [batch_size]).fetchall()
+        if not rows:
+            break
+
+        with con:
+            con.executemany("UPDATE usage SET ts = ?, day = ? "
+                            "WHERE rowid = ?",
+                            [(to_timestamp(strptime(dt_str)),
+                              int(dt_str[:8]), rowid)
+                             for rowid, dt_str in rows])
+
+        n += len(rows)
+
+    with con:
+        con.execute("CREATE INDEX IF NOT EXISTS usage_ts_day "
+                    "ON usage (ts, day)")
+        # Rows inserted by writers unaware of the ts and day columns
+        # (time is local time, like in to_timestamp())
+        con.execute(
+            """
+            CREATE TRIGGER IF NOT EXISTS usage_set_ts_day
+            AFTER INSERT ON usage
+            WHEN NEW.ts IS NULL OR NEW.day IS NULL
+            BEGIN
+                UPDATE usage
+                SET ts = CAST(strftime(
+                        '%s',
+                        substr(NEW.time, 1, 4) || '-' ||
+                        substr(NEW.time, 5, 2) || '-' ||
+                        substr(NEW.time, 7, 2) || ' ' ||
+                        substr(NEW.time, 9, 2) || ':' ||
+                        substr(NEW.time, 11, 2),
+                        'utc'
+                    ) AS INTEGER) * 1000,
+                    day = CAST(substr(NEW.time, 1, 8) AS INTEGER)
+                WHERE rowid = NEW.rowid;
+            END
+            """
+        )
+
+    return n
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import sqlite3
+from datetime import datetime
+
+from database import (DT_FMT, get_last_update, get_next_month,
+                      get_partition_path, get_partitions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed months of "
+                                                 "usage data to their own "
+                                                 "database file")
+    parser.add_argument("database", help="SQLite database")
+    parser.add_argument("--keep", type=int, default=1, metavar="MONTHS",
+                        help="number of recent months kept in the main "
+                             "database (default: 1)")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="rebuild the main database file to reclaim the "
+                             "space of moved rows")
+    args = parser.parse_args()
+
+    if args.keep < 1:
+        parser.error("--keep must be at least 1")
+
+    con = sqlite3.connect(args.database)
+    try:
+        months = partition(con, args.database, args.keep)
+    except RuntimeError as exc:
+        parser.error(str(exc))
+    else:
+        for month in months:
+            path = get_partition_path(args.database, month)
+            print(f"{month.strftime('%Y-%m')}: {path}")
+
+        if args.vacuum:
+            con.execute("VACUUM")
+    finally:
+        con.close()
+
+
+def partition(con: sqlite3.Connection, database: str,
+              keep: int) -> list[datetime]:
+    dt = get_last_update(con)
+    i = dt.year * 12 + dt.month - 1 - (keep - 1)
+    cutoff = datetime(i // 12, i % 12 + 1, 1)
+
+    first, = con.execute("SELECT MIN(time) FROM usage WHERE time < ?",
+                         [cutoff.strftime(DT_FMT)]).fetchone()
+    if first is None:
+        return []
+
+    partitions = get_partitions(con)
+    months = []
+    month = datetime.strptime(first[:6], "%Y%m")
+    while month < cutoff:
+        if month.strftime("%Y%m") in partitions:
+            raise RuntimeError(f"{month.strftime('%Y-%m')} is already "
+                               f"partitioned, but has rows in {database}")
+
+        move_month(con, get_partition_path(database, month), month)
+        months.append(month)
+        month = get_next_month(month)
+
+    return months
+
+
+def move_month(con: sqlite3.Connection, path: str, month: datetime):
+    start = month.strftime(DT_FMT)
+    stop = get_next_month(month).strftime(DT_FMT)
+    columns = [row[1] for row in con.execute("PRAGMA table_info(usage)")]
+    placeholders = ", ".join(["?" for _ in columns])
+    columns = ", ".join(columns)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+    part_con = sqlite3.connect(tmp_path)
+    for sql, in con.execute("SELECT sql FROM sqlite_master "
+                            "WHERE tbl_name = 'usage' AND sql IS NOT NULL"):
+        part_con.execute(sql)
+
+    part_con.executemany(
+        f"INSERT INTO usage ({columns}) VALUES ({placeholders})",
+        con.execute(f"SELECT {columns} FROM usage "
+                    f"WHERE time >= ? AND time < ? ORDER BY time",
+                    [start, stop])
+    )
+    part_con.commit()
+    part_con.close()
+
+    # Partitions are immutable: readers open them with immutable=1
+    os.chmod(tmp_path, 0o444)
+    os.replace(tmp_path, path)
+
+    # From now on, readers use the partition for this month
+    with con:
+        con.execute("DELETE FROM usage WHERE time >= ? AND time < ?",
+                    [start, stop])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from database import get_next_month, iter_usage, load_users, sum_values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the monthly reports "
+                                                 "of users and teams")
+    parser.add_argument("database", help="SQLite database")
+    parser.add_argument("months", nargs="+", metavar="month",
+                        help="month to build, in the YYYY-MM format")
+    parser.add_argument("-p", "--processes", type=int,
+                        default=os.cpu_count(),
+                        help="number of worker processes "
+                             "(default: number of CPUs)")
+    parser.add_argument("--chunk", type=int, default=1, metavar="DAYS",
+                        help="days of usage processed by each task "
+                             "(default: 1)")
+    args = parser.parse_args()
+
+    for month in args.months:
+        try:
+            datetime.strptime(month, "%Y-%m")
+        except ValueError:
+            parser.error(f"invalid month: {month} (expected: YYYY-MM)")
+
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        for month in args.months:
+            n = build_report(args.database, month, executor, args.chunk)
+            print(f"{month}: {n} reports")
+
+
+def build_report(database: str, month: str, executor: ProcessPoolExecutor,
+                 chunk_days: int = 1) -> int:
+    start = datetime.strptime(month, "%Y-%m")
+    stop = get_next_month(start)
+
+    # Each task aggregates a disjoint range of the month
+    futures = []
+    dt = start
+    while dt < stop:
+        chunk_stop = min(dt + timedelta(days=chunk_days), stop)
+        futures.append(executor.submit(aggregate, database, dt, chunk_stop))
+        dt = chunk_stop
+
+    users_data = {}
+    for f in futures:
+        for login, values in f.result().items():
+            sum_values(users_data.setdefault(login, {}), values)
+
+    con = sqlite3.connect(database)
+    rows = make_reports(con, month, users_data)
+
+    with con:
+        con.execute("DELETE FROM report WHERE month = ?", [month])
+        con.executemany("INSERT INTO report (login, month, data) "
+                        "VALUES (?, ?, ?)", rows)
+
+        # Invalidates the cached reports of the API
+        updated = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
+        cur = con.execute("UPDATE metadata SET value = ? "
+                          "WHERE key = 'reports'", [updated])
+        if cur.rowcount == 0:
+            con.execute("INSERT INTO metadata (key, value) "
+                        "VALUES ('reports', ?)", [updated])
+
+    con.close()
+    return len(rows)
+
+
+def aggregate(database: str, start: datetime, stop: datetime) -> dict:
+    con = sqlite3.connect(database)
+    users_data = {}
+    for ts, day, _users_data, _ in iter_usage(con, start, stop, jobs=False):
+        for login, values in _users_data.items():
+            try:
+                obj = users_data[login]
+            except KeyError:
+                obj = users_data[login] = {
+                    "co2e": 0,
+                    "cost": 0,
+                    "cputime": 0,
+                    "submitted": 0,
+                    "done": 0,
+                    "failed": 0,
+                    "memlim": 0,
+                    "memeff": [0] * len(values["memeff"])
+                }
+
+            obj["co2e"] += values["co2e"]
+            obj["cost"] += values["cost"]
+            obj["cputime"] += values["cputime"]
+            obj["submitted"] += values["submitted"]
+            obj["done"] += values["done"]
+            obj["failed"] += values["failed"]["total"]
+            obj["memlim"] += values["failed"]["memlim"]
+            for i, v in enumerate(values["memeff"]):
+                obj["memeff"][i] += v
+
+    con.close()
+    return users_data
+
+
+def make_reports(con: sqlite3.Connection, month: str,
+                 users_data: dict) -> list[tuple[str, str, str]]:
+    total_co2e = sum(values["co2e"] for values in users_data.values())
+    users = sorted(users_data.items(), key=lambda x: -x[1]["co2e"])
+
+    rows = []
+    for rank, (login, values) in enumerate(users, start=1):
+        rows.append((login, month, json.dumps({
+            "co2e": values["co2e"],
+            "cost": values["cost"],
+            "cputime": values["cputime"],
+            "jobs": {
+                "total": values["done"] + values["failed"],
+                "submitted": values["submitted"],
+                "done": values["done"],
+                "failed": values["failed"],
+                "memlim": values["memlim"]
+            },
+            # Not the 100-bin distribution of "memory" in other reports
+            "memeff": values["memeff"],
+            "rank": rank,
+            "totalCo2e": total_co2e
+        })))
+
+    # Overall report: footprint per team
+    teams = {}
+    for u in load_users(con):
+        try:
+            values = users_data[u["id"]]
+        except KeyError:
+            continue
+
+        for team in u["teams"]:
+            try:
+                obj = teams[team]
+            except KeyError:
+                obj = teams[team] = {
+                    "team": team,
+                    "jobs": 0,
+                    "cputime": 0,
+                    "co2e": 0,
+                    "cost": 0
+                }
+
+            n = len(u["teams"])
+            obj["jobs"] += (values["done"] + values["failed"]) / n
+            obj["cputime"] += values["cputime"] / n
+            obj["co2e"] += values["co2e"] / n
+            obj["cost"] += values["cost"] / n
+
+    rows.append(("_", month, json.dumps(list(teams.values()))))
+    return rows
+
+
+if __name__ == "__main__":
+    main()
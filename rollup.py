@@ -0,0 +1,149 @@
+import argparse
+import json
+import sqlite3
+from datetime import datetime
+from itertools import groupby
+
+from database import (get_last_update, get_next_month, get_usage_start,
+                      iter_sources, to_timestamp)
+
+
+# Per-user values summed by day
+COLUMNS = ["co2e", "cost", "cputime", "core_minutes"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the daily usage "
+                                                 "of users")
+    parser.add_argument("database", help="SQLite database")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.database)
+    n = build(con)
+    con.close()
+    print(f"{n} rows")
+
+
+def build(con: sqlite3.Connection) -> int:
+    # Hold the write lock: no data is ingested while we read usage rows
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute("DROP TABLE IF EXISTS daily_usage")
+        con.execute(
+            f"""
+            CREATE TABLE daily_usage (
+                day INTEGER NOT NULL,
+                login TEXT NOT NULL,
+                {', '.join([f'{col} REAL NOT NULL' for col in COLUMNS])},
+                PRIMARY KEY (day, login)
+            ) WITHOUT ROWID
+            """
+        )
+
+        n = 0
+        start = get_usage_start(con)
+        if start is not None:
+            stop = get_next_month(get_last_update(con))
+            for _con, _start, _stop in iter_sources(con, start, stop):
+                rows = _con.execute(
+                    """
+                    SELECT day, span, users_data
+                    FROM usage
+                    WHERE ts >= ? AND ts < ?
+                    ORDER BY ts
+                    """,
+                    [to_timestamp(_start), to_timestamp(_stop)]
+                )
+                # Decode and aggregate one day at a time
+                for day, day_rows in groupby(rows, key=lambda row: row[0]):
+                    n += update(con, [(day, span, json.loads(users_data))
+                                      for _, span, users_data in day_rows])
+    except Exception:
+        con.rollback()
+        raise
+    else:
+        con.commit()
+
+    return n
+
+
+def update(con: sqlite3.Connection,
+           rows: list[tuple[int, int, dict]]) -> int:
+    # Add rows of (day, span, users_data) to the daily usage of users
+    days = {}
+    for day, span, users_data in rows:
+        users = days.setdefault(day, {})
+        for login, values in users_data.items():
+            try:
+                obj = users[login]
+            except KeyError:
+                obj = users[login] = {col: 0 for col in COLUMNS}
+
+            obj["co2e"] += values["co2e"]
+            obj["cost"] += values["cost"]
+            obj["cputime"] += values["cputime"]
+            obj["core_minutes"] += values["cores"] * span
+
+    params = []
+    for day, users in days.items():
+        for login, obj in users.items():
+            params.append([day, login] + [obj[col] for col in COLUMNS])
+
+    con.executemany(
+        f"""
+        INSERT INTO daily_usage (day, login, {', '.join(COLUMNS)})
+        VALUES (?, ?, {', '.join(['?' for _ in COLUMNS])})
+        ON CONFLICT (day, login) DO UPDATE SET
+        {', '.join([f'{col} = {col} + excluded.{col}' for col in COLUMNS])}
+        """,
+        params
+    )
+    return len(params)
+
+
+def ingest(con: sqlite3.Connection, rows: list[tuple[str, dict, dict]]):
+    # Keep daily usage up-to-date with newly ingested (15-minute) rows
+    if exists(con):
+        update(con, [(int(dt_str[:8]), 15, users_data)
+                     for dt_str, users_data, _ in rows])
+
+
+def iter_days(con: sqlite3.Connection, start: datetime, stop: datetime):
+    # Daily usage, as usage rows of (ts, day, users_data, jobs_data)
+    rows = con.execute(
+        f"""
+        SELECT day, login, {', '.join(COLUMNS)}
+        FROM daily_usage
+        WHERE day >= ? AND day < ?
+        ORDER BY day
+        """,
+        [int(start.strftime("%Y%m%d")), int(stop.strftime("%Y%m%d"))]
+    )
+
+    day = users_data = None
+    for row in rows:
+        if row[0] != day:
+            if day is not None:
+                yield get_ts(day), day, users_data, None
+
+            day = row[0]
+            users_data = {}
+
+        users_data[row[1]] = dict(zip(COLUMNS, row[2:]))
+
+    if day is not None:
+        yield get_ts(day), day, users_data, None
+
+
+def get_ts(day: int) -> int:
+    return to_timestamp(datetime.strptime(str(day), "%Y%m%d"))
+
+
+def exists(con: sqlite3.Connection) -> bool:
+    row = con.execute("SELECT COUNT(*) FROM sqlite_master "
+                      "WHERE type = 'table' AND name = 'daily_usage'")
+    return row.fetchone()[0] == 1
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from database import (DT_FMT, count_usage, get_last_update, get_next_month,
+                      get_usage_start, iter_sources, iter_usage,
+                      to_timestamp)
+
+
+# Per-row totals of users values
+USAGE_COLUMNS = {
+    "cores": ("cores",),
+    "memory": ("memory",),
+    "co2e": ("co2e",),
+    "cost": ("cost",),
+    "cputime": ("cputime",),
+    "submitted": ("submitted",),
+    "completed": ("done",),
+    "failed": ("failed", "total")
+}
+# Per-row jobs statistics
+JOBS_COLUMNS = {
+    "done": ("done", "total"),
+    "done_co2e": ("done", "co2e"),
+    "wasted_co2e": ("done", "memeff", "co2e"),
+    "wasted_cost": ("done", "memeff", "cost"),
+    "exit": ("failed", "total"),
+    "exit_co2e": ("failed", "co2e"),
+    "exit_cost": ("failed", "cost"),
+    "exit_memlim": ("failed", "memlim"),
+    "more1h": ("failed", "more1h", "total"),
+    "more1h_co2e": ("failed", "more1h", "co2e")
+}
+# Per-row histograms of jobs
+JOBS_HISTOGRAMS = {
+    "cpueff": ("done", "cpueff"),
+    "memeff": ("done", "memeff", "dist"),
+    "runtimes": ("done", "runtimes")
+}
+# Per-user, per-row values
+USER_COLUMNS = {
+    "jobs": ("jobs",),
+    "cores": ("cores",),
+    "memory": ("memory",),
+    "co2e": ("co2e",),
+    "cost": ("cost",),
+    "submitted": ("submitted",),
+    "done": ("done",),
+    "failed": ("failed", "total"),
+    "memlim": ("failed", "memlim")
+}
+# Per-user histograms
+USER_HISTOGRAMS = {
+    "memeff": ("memeff",)
+}
+# Columns of counts, stored as integers (other columns as floats)
+COUNTS = {"time", "rows", "offsets", "submitted", "completed", "failed",
+          "done", "exit", "exit_memlim", "more1h", "memlim", "cpueff",
+          "memeff", "runtimes"}
+# Values buffered before they are written to the arrays
+BUFFER_SIZE = 100000
+_SNAPSHOTS = {}
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "rt") as fh:
+            meta = json.load(fh)
+
+        self.updated = datetime.strptime(meta["updated"], "%Y-%m-%d %H:%M:%S")
+        self.users = {login: i for i, login in enumerate(meta["users"])}
+        self.arrays = {}
+        for entry in os.scandir(path):
+            if entry.name.endswith(".npy"):
+                self.arrays[entry.name[:-4]] = np.load(entry.path,
+                                                       mmap_mode="r")
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def slice(self, start: datetime, stop: datetime) -> slice:
+        # Rows in [start, stop)
+        time = self.arrays["time"]
+        return slice(int(np.searchsorted(time, to_timestamp(start))),
+                     int(np.searchsorted(time, to_timestamp(stop))))
+
+    def get_entries(self, login: str,
+                    s: slice) -> tuple[slice, np.ndarray] | None:
+        # Per-user entries of a user in the given rows, and their row index
+        # (relative to the start of the rows)
+        u = self.users.get(login)
+        if u is None:
+            return None
+
+        offsets = self.arrays["user_offsets"]
+        i, j = int(offsets[u]), int(offsets[u + 1])
+        if i == j:
+            return None
+
+        rows = self.arrays["user_rows"]
+        i, j = (i + np.searchsorted(rows[i:j], [s.start, s.stop])).tolist()
+        if i == j:
+            return None
+
+        return slice(i, j), rows[i:j] - s.start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export usage data "
+                                                 "to a columnar snapshot")
+    parser.add_argument("database", help="SQLite database")
+    parser.add_argument("directory", help="snapshots directory")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="rebuild the snapshot even if up-to-date")
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.database)
+    path = export(con, args.directory, args.force)
+    con.close()
+
+    if path:
+        print(path)
+
+
+def load(directory: str) -> Snapshot | None:
+    # Latest snapshot, kept open (memory-mapped) until a new one is exported
+    path = os.path.realpath(os.path.join(directory, "current"))
+    if not os.path.isdir(path):
+        return None
+
+    snapshot = _SNAPSHOTS.get(directory)
+    if snapshot is None or snapshot.path != path:
+        snapshot = _SNAPSHOTS[directory] = Snapshot(path)
+
+    return snapshot
+
+
+def export(con: sqlite3.Connection, directory: str,
+           force: bool = False) -> str | None:
+    # Read transaction: consistent view of the usage data
+    con.execute("BEGIN")
+    try:
+        return _export(con, directory, force)
+    finally:
+        con.rollback()
+
+
+def _export(con: sqlite3.Connection, directory: str,
+            force: bool) -> str | None:
+    updated = get_last_update(con)
+    version = updated.strftime("%Y%m%d%H%M%S")
+    path = os.path.join(directory, version)
+    if os.path.isdir(path) and not force:
+        return None
+
+    start = get_usage_start(con)
+    if start is None:
+        return None
+
+    stop = get_next_month(updated)
+    n = count_usage(con, start, stop)
+    if n == 0:
+        return None
+
+    logins = [row[0] for row in con.execute("SELECT login FROM user "
+                                            "ORDER BY login")]
+    users = {login: i for i, login in enumerate(logins)}
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    arrays = {}
+
+    def write(name: str, index, values: list, size: int):
+        # Write buffered values, creating the array on first use
+        if not values:
+            return
+
+        try:
+            arr = arrays[name]
+        except KeyError:
+            dtype = "i8" if name.removeprefix("user_") in COUNTS else "f8"
+            arr = arrays[name] = open_memmap(
+                os.path.join(tmp_path, f"{name}.npy"), mode="w+",
+                dtype=dtype, shape=(size,) + np.shape(values[0])
+            )
+
+        arr[index] = values
+        values.clear()
+
+    # Per-user values are stored by user (CSR-like): the entries of user u
+    # are user_offsets[u]:user_offsets[u+1], in chronological order, and
+    # user_rows holds the index of their row
+    counts = count_user_rows(con, start, stop)
+    offsets = np.zeros(len(logins) + 1, dtype="i8")
+    np.cumsum([counts.get(login, 0) for login in logins], out=offsets[1:])
+    nnz = int(offsets[-1])
+    entries = offsets[:-1].tolist()
+
+    row_names = (["time"] + list(USAGE_COLUMNS) + list(JOBS_COLUMNS)
+                 + list(JOBS_HISTOGRAMS))
+    row_values = {name: [] for name in row_names}
+    user_names = (["rows"] + list(USER_COLUMNS) + list(USER_HISTOGRAMS))
+    user_values = {name: [] for name in user_names}
+    user_index = []
+
+    def flush(i: int):
+        index = slice(i - len(row_values["time"]), i)
+        for name, values in row_values.items():
+            write(name, index, values, n)
+
+        if user_index:
+            index = np.array(user_index)
+            user_index.clear()
+            for name, values in user_values.items():
+                write(f"user_{name}", index, values, nnz)
+
+    i = 0
+    for ts, day, users_data, jobs_data in iter_usage(con, start, stop):
+        row_values["time"].append(ts)
+        for name, keys in JOBS_COLUMNS.items():
+            row_values[name].append(get_value(jobs_data, keys))
+
+        for name, keys in JOBS_HISTOGRAMS.items():
+            row_values[name].append(get_value(jobs_data, keys))
+
+        totals = {name: 0 for name in USAGE_COLUMNS}
+        for login, values in users_data.items():
+            for name, keys in USAGE_COLUMNS.items():
+                totals[name] += get_value(values, keys)
+
+            try:
+                u = users[login]
+            except KeyError:
+                continue
+
+            user_index.append(entries[u])
+            entries[u] += 1
+            user_values["rows"].append(i)
+            for name, keys in USER_COLUMNS.items():
+                user_values[name].append(get_value(values, keys))
+
+            for name, keys in USER_HISTOGRAMS.items():
+                user_values[name].append(get_value(values, keys))
+
+        for name, value in totals.items():
+            row_values[name].append(value)
+
+        i += 1
+        if len(user_index) >= BUFFER_SIZE or i % BUFFER_SIZE == 0:
+            flush(i)
+
+    flush(i)
+    write("user_offsets", slice(None), offsets.tolist(), len(offsets))
+    for arr in arrays.values():
+        arr.flush()
+
+    with open(os.path.join(tmp_path, "meta.json"), "wt") as fh:
+        json.dump({
+            "updated": updated.strftime("%Y-%m-%d %H:%M:%S"),
+            "start": start.strftime(DT_FMT),
+            "stop": stop.strftime(DT_FMT),
+            "users": logins
+        }, fh)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+    # Atomically switch to the new snapshot
+    link = os.path.join(directory, "current")
+    tmp_link = f"{link}.tmp"
+    try:
+        os.unlink(tmp_link)
+    except FileNotFoundError:
+        pass
+
+    try:
+        previous = os.readlink(link)
+    except FileNotFoundError:
+        previous = None
+
+    os.symlink(version, tmp_link)
+    os.replace(tmp_link, link)
+
+    # Workers still using older snapshots keep their mappings. The previous
+    # snapshot is kept until the next export, as workers may be loading it
+    keep = (version, previous)
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False) and entry.name not in keep:
+            shutil.rmtree(entry.path)
+
+    return path
+
+
+def count_user_rows(con: sqlite3.Connection, start: datetime,
+                    stop: datetime) -> dict[str, int]:
+    # Number of rows each user appears in
+    counts = {}
+    for _con, _start, _stop in iter_sources(con, start, stop):
+        for login, count in _con.execute(
+                """
+                SELECT key, COUNT(*)
+                FROM usage, json_each(usage.users_data)
+                WHERE ts >= ? AND ts < ?
+                GROUP BY key
+                """,
+                [to_timestamp(_start), to_timestamp(_stop)]):
+            counts[login] = counts.get(login, 0) + count
+
+    return counts
+
+
+def get_value(obj: dict, keys: tuple):
+    for key in keys:
+        obj = obj[key]
+
+    return obj
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# Settings required to import the API
+_tmpdir = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE", os.path.join(_tmpdir, "database.sqlite"))
+os.environ.setdefault("ADMIN_EMAIL", "admin@example.org")
+os.environ.setdefault("ADMIN_PASSWORD", "password")
+os.environ.setdefault("SMTP_HOST", "localhost")
+os.environ.setdefault("SMTP_PORT", "25")
@@ -0,0 +1,77 @@
+import pytest
+
+from compact import merge
+
+
+def make_row(dt_str, span, users_data, jobs_data=None):
+    return dt_str, span, users_data, jobs_data or {}
+
+
+def test_merge_weights_averaged_values_by_span():
+    span, users_data, _ = merge([
+        make_row("202211150000", 15, {"a": {"cores": 4, "memory": 8},
+                                      "b": {"cores": 4, "memory": 2}}),
+        make_row("202211150015", 45, {"a": {"cores": 8, "memory": 4}}),
+    ])
+
+    assert span == 60
+    assert users_data["a"]["cores"] == pytest.approx(7)
+    assert users_data["a"]["memory"] == pytest.approx(5)
+    # No usage outside of the rows the user appears in
+    assert users_data["b"]["cores"] == pytest.approx(1)
+    assert users_data["b"]["memory"] == pytest.approx(0.5)
+
+
+def test_merge_sums_other_values():
+    _, users_data, jobs_data = merge([
+        make_row("202211150000", 15,
+                 {"a": {"co2e": 1.5, "submitted": 2,
+                        "failed": {"total": 1, "memlim": 1},
+                        "memeff": [1, 0, 0, 2, 0]}},
+                 {"done": {"total": 3, "runtimes": [1, 2, 0]},
+                  "failed": {"total": 1, "more1h": {"total": 1}}}),
+        make_row("202211150015", 15,
+                 {"a": {"co2e": 0.5, "submitted": 1,
+                        "failed": {"total": 2, "memlim": 0},
+                        "memeff": [0, 1, 0, 1, 3]}},
+                 {"done": {"total": 2, "runtimes": [0, 1, 4]},
+                  "failed": {"total": 0, "more1h": {"total": 2}}}),
+    ])
+
+    assert users_data["a"]["co2e"] == pytest.approx(2)
+    assert users_data["a"]["submitted"] == 3
+    assert users_data["a"]["failed"] == {"total": 3, "memlim": 1}
+    assert users_data["a"]["memeff"] == [1, 1, 0, 3, 3]
+    assert jobs_data == {"done": {"total": 5, "runtimes": [1, 3, 4]},
+                         "failed": {"total": 1, "more1h": {"total": 3}}}
+
+
+def test_merge_hourly_rows_into_daily_rows():
+    rows = []
+    for hour in range(24):
+        for minute in range(0, 60, 15):
+            rows.append(make_row(
+                f"20221115{hour:02}{minute:02}", 15,
+                {"a": {"cores": hour, "co2e": 1, "memeff": [1, 0, 0, 0, 0]}}
+                if minute else {},
+                {"done": {"total": 1}}
+            ))
+
+    hourly = []
+    for i in range(0, len(rows), 4):
+        bucket = rows[i:i+4]
+        hourly.append(make_row(bucket[0][0], *merge(bucket)))
+
+    assert [span for _, span, _, _ in hourly] == [60] * 24
+    assert hourly[2][2]["a"]["cores"] == pytest.approx(1.5)
+
+    span, users_data, jobs_data = merge(hourly)
+    # Same result as merging the 15-minute rows directly
+    _span, _users_data, _jobs_data = merge(rows)
+    assert (span, jobs_data) == (_span, _jobs_data)
+    assert users_data["a"]["cores"] == pytest.approx(_users_data["a"]["cores"])
+    assert span == 24 * 60
+    assert users_data["a"]["cores"] == pytest.approx(11.5 * 3 / 4)
+    assert users_data["a"]["co2e"] == 72
+    assert users_data["a"]["memeff"] == [72, 0, 0, 0, 0]
+    assert jobs_data == {"done": {"total": 96}}
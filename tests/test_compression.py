@@ -0,0 +1,50 @@
+import gzip
+
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from compression import CompressionMiddleware
+
+
+BODY = b'{"data": [' + b",".join([b"1"] * 2000) + b"]}"
+RESPONSE = Response(content=BODY, media_type="application/json")
+
+
+async def cached(request):
+    return RESPONSE
+
+
+async def streamed(request):
+    return StreamingResponse(iter([BODY, BODY]), media_type="text/csv")
+
+
+app = Starlette(routes=[Route("/cached", cached),
+                        Route("/streamed", streamed)])
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+client = TestClient(app)
+
+
+def test_same_response_sent_twice():
+    headers = RESPONSE.raw_headers.copy()
+    for _ in range(2):
+        r = client.get("/cached", headers={"Accept-Encoding": "gzip"})
+        assert r.status_code == 200
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert r.content == BODY
+
+    # The response sent uncompressed
+    r = client.get("/cached", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in r.headers
+    assert r.headers["Content-Length"] == str(len(BODY))
+    assert r.content == BODY
+    assert RESPONSE.raw_headers == headers
+
+
+def test_streamed_response():
+    with client.stream("GET", "/streamed",
+                       headers={"Accept-Encoding": "gzip"}) as r:
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert "Content-Length" not in r.headers
+        assert gzip.decompress(b"".join(r.iter_raw())) == BODY * 2
@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from api import encode_series
+
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                          "client")
+
+
+def decode_series(series: dict) -> list:
+    values = []
+    value = 0
+    runs = series["runs"]
+    for diff, count in zip(runs[::2], runs[1::2]):
+        for _ in range(count):
+            value += diff
+            values.append(value / series["scale"])
+
+    return values
+
+
+def test_encode_series():
+    timestamps = [1668470400000 + i * 900000 for i in range(96)]
+    assert encode_series(timestamps) == {
+        "scale": 1,
+        "runs": [1668470400000, 1, 900000, 95]
+    }
+    assert encode_series([]) == {"scale": 1, "runs": []}
+    assert encode_series([3, 3, 1, 1, 1]) == {
+        "scale": 1,
+        "runs": [3, 1, 0, 1, -2, 1, 0, 2]
+    }
+
+
+def test_encode_series_precision():
+    values = [0.5, 1.25, 1.254, 0, 10.111]
+    series = encode_series(values, 2)
+    assert series["scale"] == 100
+    assert decode_series(series) == [0.5, 1.25, 1.25, 0, 10.11]
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="requires Node.js")
+def test_decode_series_client(tmp_path):
+    values = [0, 12.5, 12.5, 12.5, 7.25, 1e6, 1e6 + 0.01]
+    series = encode_series(values, 2)
+
+    # Client modules are ES modules, without a package.json
+    shutil.copy(os.path.join(CLIENT_DIR, "modules", "utils.js"),
+                tmp_path / "utils.mjs")
+    script = tmp_path / "decode.mjs"
+    script.write_text(
+        'import {decodeSeries} from "./utils.mjs";\n'
+        f"console.log(JSON.stringify(decodeSeries({json.dumps(series)})));\n"
+    )
+    output = subprocess.run(["node", str(script)], capture_output=True,
+                            check=True, text=True).stdout
+    assert json.loads(output) == pytest.approx(values)